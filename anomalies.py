@@ -0,0 +1,174 @@
+import argparse
+from collections import namedtuple
+from typing import List, Optional, Tuple
+import numpy as np
+
+from structuredlog import LogEntry, process
+from duration_stats import Durations, group_stats
+from log_analysis import get_durations, get_responses
+from session_index import to_milliseconds
+from instrument import metrics, add_profile_arguments, start_profile, finish_profile
+
+# Finds time windows where a path got slower, or started failing, compared to its own recent past.  Responses are
+# bucketed into (path, window) groups with one sort, giving P95 and error rate per group.  Each group is then
+# scored against the same path's previous HISTORY windows with a robust z-score - distance from their median in
+# units of their median absolute deviation - so a path that's always slow isn't flagged, and one bad window doesn't
+# throw off the next.  Everything works on arrays of groups, not per path loops, so thousands of paths over days of
+# logs is fine.
+
+WINDOW_MINUTES = 5
+# windows the baseline is taken from: the path's last HISTORY windows that had traffic
+HISTORY = 12
+# the baseline needs at least this many windows with MIN_COUNT responses
+MIN_HISTORY = 4
+# windows with fewer responses than this are too noisy to flag or to use as baseline
+MIN_COUNT = 20
+# robust z-score that counts as an anomaly
+THRESHOLD = 3.5
+# and P95 has to be at least this many times the baseline, since a P95 from a few dozen responses is noisy
+MIN_RATIO = 2.0
+# smallest spread the baseline is given credit for, so a path that's been perfectly steady doesn't flag on a few ms
+MIN_SCALE_MS = 50
+MIN_SCALE_FRACTION = 0.1
+MIN_ERROR_SCALE = 0.02
+MIN_ERRORS = 5
+# MAD times this estimates the standard deviation for normal data
+MAD_SCALE = 1.4826
+# groups scored at a time, bounding the (rows x HISTORY) baseline matrix
+CHUNK_ROWS = 100000
+
+# kind is 'p95' (value/baseline in ms) or 'errors' (value/baseline are 5xx fractions).  window_start and window_end
+# are 'YYYY-MM-DD HH:MM', both inclusive
+Anomaly = namedtuple('Anomaly', 'path window_start window_end kind value baseline score count')
+
+
+# Responses bucketed by (path, window).  Groups are sorted by path then window
+class PathWindows:
+    def __init__(self, durations : Durations, timestamps : np.ndarray, errors : np.ndarray, window_minutes : int = WINDOW_MINUTES):
+        self.names = durations.names
+        self.window_ms = window_minutes * 60 * 1000
+        window = timestamps // self.window_ms
+        first_window = int(window.min()) if len(window) else 0
+        window_count = int(window.max()) - first_window + 1 if len(window) else 1
+        key = durations.codes.astype(np.int64) * window_count + (window - first_window)
+
+        order = np.lexsort((durations.durations, key))
+        keys, starts, counts = np.unique(key[order], return_index=True, return_counts=True)
+        self.code = keys // window_count
+        self.window = keys % window_count + first_window
+        self.count = counts
+        self.p95 = group_stats(durations.durations[order], counts, (95,))['P95'] if len(keys) else np.array([])
+        self.errors = np.add.reduceat(errors[order].astype(np.int64), starts) if len(keys) else np.array([], dtype=np.int64)
+        self.error_rate = self.errors / np.maximum(counts, 1)
+
+    def __len__(self):
+        return len(self.code)
+
+    def window_text(self, window : int, offset_ms : int = 0) -> str:
+        return np.datetime_as_string(np.datetime64(int(window) * self.window_ms + offset_ms, 'ms'), unit='m').replace('T', ' ')
+
+
+# Median and MAD of each row's previous history rows in the same group, plus how many rows went into them (fewer
+# at the start of a group).  Rows are expected sorted by group
+def rolling_baseline(values : np.ndarray, groups : np.ndarray, history : int = HISTORY) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    median = np.full(len(values), np.nan)
+    mad = np.full(len(values), np.nan)
+    used = np.zeros(len(values), dtype=np.int64)
+    back = np.arange(history, 0, -1)
+    for chunk_start in range(0, len(values), CHUNK_ROWS):
+        rows = np.arange(chunk_start, min(len(values), chunk_start + CHUNK_ROWS))
+        previous = rows[:, None] - back[None, :]
+        clipped = np.maximum(previous, 0)
+        valid = (previous >= 0) & (groups[clipped] == groups[rows][:, None])
+        matrix = np.where(valid, values[clipped], np.nan)
+        median[rows] = row_medians(matrix)
+        mad[rows] = row_medians(np.abs(matrix - median[rows][:, None]))
+        used[rows] = np.sum(valid, axis=1)
+    return median, mad, used
+
+# median of each row, ignoring NaN.  np.nanmedian does the same but is far slower on lots of short rows
+def row_medians(matrix : np.ndarray) -> np.ndarray:
+    ordered = np.sort(matrix, axis=1)   # NaN sorts last
+    count = np.sum(~np.isnan(matrix), axis=1)
+    low = np.take_along_axis(ordered, np.maximum((count - 1) // 2, 0)[:, None], axis=1)[:, 0]
+    high = np.take_along_axis(ordered, (count // 2)[:, None] - (count == 0)[:, None], axis=1)[:, 0]
+    return np.where(count > 0, (low + high) / 2, np.nan)
+
+# robust z-score of values against their baseline, with the spread floored at min_scale
+def robust_scores(values : np.ndarray, median : np.ndarray, mad : np.ndarray, min_scale : np.ndarray) -> np.ndarray:
+    scale = np.maximum(MAD_SCALE * np.nan_to_num(mad), min_scale)
+    with np.errstate(invalid='ignore'):
+        return (values - median) / scale
+
+
+# Only windows with MIN_COUNT responses are scored or used as baseline, so the quiet ones are dropped up front
+@metrics.timed('anomalies')
+def find_anomalies(windows : PathWindows, threshold : float = THRESHOLD) -> List[Anomaly]:
+    busy = np.flatnonzero(windows.count >= MIN_COUNT)
+    codes = windows.code[busy]
+    anomalies = []
+
+    p95 = windows.p95[busy]
+    median, mad, used = rolling_baseline(p95, codes)
+    scores = robust_scores(p95, median, mad, np.maximum(MIN_SCALE_MS, MIN_SCALE_FRACTION * np.nan_to_num(median)))
+    with np.errstate(invalid='ignore'):
+        flagged = (used >= MIN_HISTORY) & (scores >= threshold) & (p95 >= MIN_RATIO * median)
+    anomalies.extend(make_anomalies(windows, 'p95', busy, np.flatnonzero(flagged), p95, median, scores))
+
+    error_rate = windows.error_rate[busy]
+    median, mad, used = rolling_baseline(error_rate, codes)
+    scores = robust_scores(error_rate, median, mad, np.full(len(busy), MIN_ERROR_SCALE))
+    with np.errstate(invalid='ignore'):
+        flagged = (used >= MIN_HISTORY) & (windows.errors[busy] >= MIN_ERRORS) & (scores >= threshold)
+    anomalies.extend(make_anomalies(windows, 'errors', busy, np.flatnonzero(flagged), error_rate, median, scores))
+
+    anomalies.sort(key=lambda anomaly: -anomaly.score)
+    return anomalies
+
+# rows index into values/baseline/scores, which are for the windows.rows[busy] subset
+def make_anomalies(windows : PathWindows, kind : str, busy : np.ndarray, rows : np.ndarray, values : np.ndarray, baseline : np.ndarray, scores : np.ndarray) -> List[Anomaly]:
+    last_minute = windows.window_ms - 60 * 1000
+    anomalies = []
+    for row in rows:
+        group = busy[row]
+        anomalies.append(Anomaly(windows.names[windows.code[group]], windows.window_text(windows.window[group]),
+                                 windows.window_text(windows.window[group], last_minute), kind, float(values[row]),
+                                 float(baseline[row]), float(scores[row]), int(windows.count[group])))
+    return anomalies
+
+
+# P95 and error rate anomalies for the responses in log_entries.  Pass durations if they've already been worked
+# out with log_analysis.get_durations
+def get_anomalies(log_entries : List[LogEntry], durations : Optional[Durations] = None, window_minutes : int = WINDOW_MINUTES,
+                  threshold : float = THRESHOLD) -> List[Anomaly]:
+    responses = get_responses(log_entries)
+    if durations is None:
+        durations = get_durations(log_entries)
+    timestamps = to_milliseconds([response.timestamp for response in responses])
+    errors = np.array([response.response_code.startswith('5') for response in responses], dtype=bool)
+    return find_anomalies(PathWindows(durations, timestamps, errors, window_minutes), threshold)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Finds time windows where a request path got slower or started failing')
+    parser.add_argument('filenames', nargs='+', help='Wildfly server.log files')
+    parser.add_argument('--window', action='store', type=int, default=WINDOW_MINUTES, help='Window size in minutes (default %(default)s)')
+    parser.add_argument('--threshold', action='store', type=float, default=THRESHOLD, help='Robust z-score to flag (default %(default)s)')
+    parser.add_argument('--from', dest='start', action='store', required=False, help='Only read entries at or after this time, e.g. "2023-01-21 03:00"')
+    parser.add_argument('--to', dest='end', action='store', required=False, help='Only read entries up to this time, inclusive, e.g. "2023-01-21 03:05"')
+    add_profile_arguments(parser)
+    args = parser.parse_args()
+    profiler = start_profile(args)
+
+    for anomaly in get_anomalies(process(args.filenames, args.start, args.end), window_minutes=args.window, threshold=args.threshold):
+        if anomaly.kind == 'p95':
+            change = f'P95 {anomaly.value:,.0f}ms, usually {anomaly.baseline:,.0f}ms'
+        else:
+            change = f'errors {100 * anomaly.value:.1f}%, usually {100 * anomaly.baseline:.1f}%'
+        print(f'{anomaly.window_start}  score {anomaly.score:6.1f}  {change}  ({anomaly.count} requests)  {anomaly.path}')
+
+    finish_profile(args, profiler)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,14 +1,17 @@
-from pydantic import BaseModel
+from dataclasses import dataclass
 from io import TextIOWrapper
 import re
 import argparse
-from typing import Dict, List
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+from logindex import read_lines
+from instrument import metrics, add_profile_arguments, start_profile, finish_profile
 
 aspen_log_entry_pattern = re.compile( r'^(?P<timestamp>\d+-\d+-\d+ \d+:\d+:\d+ .\d+)\s(?P<level>[a-zA-Z0-9]+):\s+\[(?P<source>[^]]+)]\s+\[(?P<logtype>[^]]+)]\s(?P<remainder>.*)')
 
 message_id_pattern = re.compile(r'^(?P<id>[A-Z]{3}-\d{5}):\s*(?P<message>.*)$')
 
-class AspenLogEntry(BaseModel):
+@dataclass
+class AspenLogEntry:
     timestamp: str
     level: str
     source: str
@@ -16,6 +19,7 @@ class AspenLogEntry(BaseModel):
     id: str
     message: str
     lines: list[str]
+    host: str = ''
 
     @classmethod
     def from_match(cls, match:re.Match[str]):
@@ -42,33 +46,45 @@ class AspenLogEntry(BaseModel):
         # print('message', self.message)
 
 
-def process_file(open_file: TextIOWrapper) -> List[AspenLogEntry]:
-    log_entry = None
-    log_entries : List[AspenLogEntry] = []
+# lines are (line number, line) pairs, see logindex.read_lines
+@metrics.timed('aspen_parse')
+def process_lines(lines: Iterable[Tuple[int, str]]) -> List[AspenLogEntry]:
+    return list(iter_entries(lines))
+
+# Entries one at a time, each handed out once the next one starts (so it has all its continuation lines)
+def iter_entries(lines: Iterable[Tuple[int, str]]) -> Iterator[AspenLogEntry]:
+    entry = None
 
-    for line_number, line in enumerate(open_file):
+    for line_number, line in lines:
         line = line.rstrip()
         match = aspen_log_entry_pattern.match(line)
         if match:
+            if entry:
+                yield entry
             entry = AspenLogEntry.from_match(match)
-            log_entries.append(entry)
-        elif len(log_entries) > 0:
-            log_entries[-1].lines.append(line)
+        elif entry:
+            entry.lines.append(line)
         else:
             print("Whups, error, looks like continuation of log entry before we've had log entry")
 
-    return log_entries
+    if entry:
+        yield entry
 
-def process_aspenlog( file_names : List[str]) -> List[AspenLogEntry]:
+def process_file(open_file: TextIOWrapper) -> List[AspenLogEntry]:
+    return process_lines(enumerate(open_file, 1))
+
+# start and end limit entries to a time window, e.g. '2023-01-21 03:00'.  See logindex
+def process_aspenlog( file_names : List[str], start : Optional[str] = None, end : Optional[str] = None) -> List[AspenLogEntry]:
     if not file_names:
         return []
     
     list = []
     for file_name in file_names:
-        with open(file_name) as open_file:
-            list.extend(process_file(open_file))
-            print('list len ', len(list))
-    list.sort(key=lambda x: x.timestamp)
+        list.extend(process_lines(read_lines(file_name, start, end)))
+        print('list len ', len(list))
+    with metrics.stage('sort'):
+        list.sort(key=lambda x: x.timestamp)
+    metrics.count('aspen_log_entries', len(list))
     return list
 
 def main():
@@ -76,13 +92,19 @@ def main():
     parser = argparse.ArgumentParser(description='Reads log file and extracts ')
     parser.add_argument('filename', type=str, help='Aspen Wildfly  log file' )
     parser.add_argument('--debug', action='store_true', required=False, help='Dumps debug output')
+    parser.add_argument('--from', dest='start', action='store', required=False, help='Only read entries at or after this time, e.g. "2023-01-21 03:00"')
+    parser.add_argument('--to', dest='end', action='store', required=False, help='Only read entries up to this time, inclusive, e.g. "2023-01-21 03:05"')
+    add_profile_arguments(parser)
     args = parser.parse_args()
+    profiler = start_profile(args)
 
-    log_entries = process_aspenlog([args.filename])
+    log_entries = process_aspenlog([args.filename], args.start, args.end)
     # if args.debug:
     #     for entry in log_entries:
     #         entry.dump()
 
+    finish_profile(args, profiler)
+
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,294 @@
+import argparse
+import json
+import multiprocessing
+import os
+from queue import Empty
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, List, Optional, Tuple
+
+from loggen import generate, parse_size
+
+# Parser throughput benchmarks.  Each case runs in its own process on a generated log, so peak RSS is just that
+# case, and reports lines/sec, MB/s, peak RSS and how long each stage took.  Results can be saved as a baseline
+# and later runs compared against it.
+#
+#   python benchmark.py --sizes 10MB,100MB --save-baseline bench_baseline.json
+#   python benchmark.py --sizes 10MB,100MB --baseline bench_baseline.json
+#
+# --imports instead times how long each module takes to import in a fresh interpreter, and fails if one of the
+# parsing modules pulls in numpy, pandas or the web stack.
+#
+#   python benchmark.py --imports --save-baseline import_baseline.json
+
+DEFAULT_WORKDIR = os.path.join(tempfile.gettempdir(), 'log-processing-bench')
+# slower than the baseline by more than this percent counts as a regression
+DEFAULT_THRESHOLD = 10.0
+# seconds between checks that a case's child process is still running
+POLL_SECONDS = 1.0
+
+
+def stage(stages : Dict[str, float], name : str, start : float) -> float:
+    now = time.perf_counter()
+    stages[name] = stages.get(name, 0.0) + now - start
+    return now
+
+
+def case_structuredlog(file_name : str) -> Dict[str, float]:
+    from structuredlog import process_lines
+    from logindex import read_lines
+    stages = {}
+    start = time.perf_counter()
+    log_entries = process_lines(read_lines(file_name))
+    start = stage(stages, 'parse', start)
+    log_entries.sort(key=lambda x: x.timestamp)
+    stage(stages, 'sort', start)
+    return stages
+
+def case_logweb(file_name : str) -> Dict[str, float]:
+    from structuredlog import process_lines
+    from logindex import read_lines
+    from exception_entry import get_exceptions
+    from tool_entry import get_tools_and_mark_log_entries_with_concurrent_jobs
+    from log_analysis import get_dataframe, get_durations
+    stages = {}
+    start = time.perf_counter()
+    log_entries = process_lines(read_lines(file_name))
+    start = stage(stages, 'parse', start)
+    log_entries.sort(key=lambda x: x.timestamp)
+    start = stage(stages, 'sort', start)
+    get_exceptions(log_entries)
+    start = stage(stages, 'exceptions', start)
+    get_tools_and_mark_log_entries_with_concurrent_jobs(log_entries)
+    start = stage(stages, 'tools', start)
+    durations = get_durations(log_entries)
+    start = stage(stages, 'durations', start)
+    get_dataframe(durations)
+    stage(stages, 'dataframe', start)
+    return stages
+
+def case_aspenlog(file_name : str) -> Dict[str, float]:
+    from aspenlog import process_lines
+    from logindex import read_lines
+    stages = {}
+    start = time.perf_counter()
+    log_entries = process_lines(read_lines(file_name))
+    start = stage(stages, 'parse', start)
+    log_entries.sort(key=lambda x: x.timestamp)
+    stage(stages, 'sort', start)
+    return stages
+
+def case_perfmon2csv(file_name : str) -> Dict[str, float]:
+    from perfmon2csv import process_perfmon
+    stages = {}
+    start = time.perf_counter()
+    process_perfmon(file_name)
+    stage(stages, 'parse', start)
+    return stages
+
+def case_aspenp95(file_name : str) -> Dict[str, float]:
+    from duration_stats import read_durations, summarize
+    stages = {}
+    start = time.perf_counter()
+    durations = read_durations(file_name)
+    start = stage(stages, 'read', start)
+    summarize(durations)
+    stage(stages, 'summarize', start)
+    return stages
+
+
+# case name -> (function, kind of log it reads)
+CASES = {
+    'structuredlog': (case_structuredlog, 'server'),
+    'logweb': (case_logweb, 'server'),
+    'aspenp95': (case_aspenp95, 'server'),
+    'aspenlog': (case_aspenlog, 'aspen'),
+    'perfmon2csv': (case_perfmon2csv, 'perfmon'),
+}
+
+
+# module -> whether it has to import without any of HEAVY_MODULES
+IMPORT_CASES = {
+    'instrument': True,
+    'logindex': True,
+    'structuredlog': True,
+    'aspenlog': True,
+    'perfmon2csv': True,
+    'exception_entry': True,
+    'tool_entry': True,
+    'streaming': True,
+    'export': True,
+    'log_store': True,
+    'logweb': False,
+    'duration_stats': False,
+}
+HEAVY_MODULES = ['numpy', 'pandas', 'pydantic', 'dateutil', 'flask', 'connexion', 'pyarrow']
+# each import is timed this many times, keeping the fastest
+IMPORT_REPEAT = 5
+
+IMPORT_SCRIPT = '''
+import json, sys, time
+start = time.perf_counter()
+import {module}
+seconds = time.perf_counter() - start
+print(json.dumps({{'seconds': seconds, 'heavy': [name for name in {heavy!r} if name in sys.modules]}}))
+'''
+
+def run_import(module : str) -> dict:
+    script = IMPORT_SCRIPT.format(module=module, heavy=HEAVY_MODULES)
+    runs = []
+    for _ in range(IMPORT_REPEAT):
+        output = subprocess.run([sys.executable, '-c', script], cwd=os.path.dirname(os.path.abspath(__file__)),
+                                capture_output=True, text=True, check=True).stdout
+        runs.append(json.loads(output.splitlines()[-1]))
+    seconds = min(run['seconds'] for run in runs)
+    return {'seconds': seconds, 'heavy': runs[0]['heavy']}
+
+def print_import_results(results : Dict[str, dict], baseline : Dict[str, dict]):
+    print(f'{"module":<28} {"ms":>8} {"vs base":>8}  heavy modules loaded')
+    for key, result in results.items():
+        change = ''
+        if key in baseline:
+            change = f'{percent_change(result, baseline[key]):+.1f}%'
+        print(f'{key:<28} {result["seconds"] * 1000:>8.1f} {change:>8}  {", ".join(result["heavy"])}')
+
+
+def run_case_in_child(name : str, file_name : str, queue):
+    stages = CASES[name][0](file_name)
+    # ru_maxrss is KB on linux
+    queue.put({'stages': stages, 'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024})
+
+# None if the child died without a result (an exception, which it prints, or killed for running out of memory)
+def run_case(name : str, file_name : str, lines : int) -> Optional[dict]:
+    context = multiprocessing.get_context('spawn')
+    queue = context.Queue()
+    process = context.Process(target=run_case_in_child, args=(name, file_name, queue))
+    start = time.perf_counter()
+    process.start()
+    result = None
+    while result is None:
+        try:
+            result = queue.get(timeout=POLL_SECONDS)
+        except Empty:
+            if not process.is_alive():
+                # it may have put its result just before exiting
+                try:
+                    result = queue.get(timeout=POLL_SECONDS)
+                except Empty:
+                    pass
+                break
+    process.join()
+    if result is None or process.exitcode != 0:
+        print(f'{name} failed on {file_name} (exit code {process.exitcode})', file=sys.stderr)
+        return None
+    seconds = sum(result['stages'].values())
+    megabytes = os.path.getsize(file_name) / (1024 * 1024)
+    return {
+        'seconds': seconds,
+        'lines_per_second': lines / seconds if seconds else 0.0,
+        'mb_per_second': megabytes / seconds if seconds else 0.0,
+        'peak_rss_mb': result['peak_rss_mb'],
+        'stages': result['stages'],
+        'wall_seconds': time.perf_counter() - start,
+    }
+
+
+# Generated logs are kept in workdir, named by kind, size and seed, so they're only made once
+def get_log(workdir : str, kind : str, size : int, seed : int) -> Tuple[str, int]:
+    file_name = os.path.join(workdir, f'{kind}-{size}-{seed}.log')
+    lines_file = file_name + '.lines'
+    if not (os.path.exists(file_name) and os.path.exists(lines_file)):
+        print(f'generating {file_name}', file=sys.stderr)
+        lines = generate(kind, file_name, size, seed)
+        with open(lines_file, 'w') as open_file:
+            open_file.write(str(lines))
+    with open(lines_file) as open_file:
+        return file_name, int(open_file.read())
+
+
+def print_results(results : Dict[str, dict], baseline : Dict[str, dict]):
+    print(f'{"case":<28} {"lines/s":>12} {"MB/s":>8} {"peak MB":>8} {"vs base":>8}  stages')
+    for key, result in results.items():
+        change = ''
+        if key in baseline:
+            change = f'{percent_change(result, baseline[key]):+.1f}%'
+        stages = ' '.join(f'{name}={seconds:.2f}s' for name, seconds in result['stages'].items())
+        print(f'{key:<28} {result["lines_per_second"]:>12,.0f} {result["mb_per_second"]:>8.1f} {result["peak_rss_mb"]:>8.0f} {change:>8}  {stages}')
+
+# positive is faster than baseline
+def percent_change(result : dict, base : dict) -> float:
+    if 'mb_per_second' not in base:
+        # import timings
+        return 100.0 * (base['seconds'] - result['seconds']) / base['seconds'] if base['seconds'] else 0.0
+    if not base['mb_per_second']:
+        return 0.0
+    return 100.0 * (result['mb_per_second'] - base['mb_per_second']) / base['mb_per_second']
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmarks log parser throughput on generated logs')
+    parser.add_argument('--sizes', action='store', default='10MB', help='Comma separated log sizes, e.g. 10MB,1GB (default 10MB)')
+    parser.add_argument('--cases', action='store', default=','.join(CASES.keys()), help='Comma separated cases (default all: %(default)s)')
+    parser.add_argument('--seed', action='store', type=int, default=1, help='Random seed for the generated logs (default 1)')
+    parser.add_argument('--workdir', action='store', default=DEFAULT_WORKDIR, help='Where generated logs are kept (default %(default)s)')
+    parser.add_argument('--baseline', action='store', required=False, help='Baseline results to compare against')
+    parser.add_argument('--save-baseline', action='store', required=False, help='Write results to this file as the new baseline')
+    parser.add_argument('--imports', action='store_true', required=False, help='Time module imports instead of parsing, and check the parsing modules only import the standard library')
+    parser.add_argument('--threshold', action='store', type=float, default=DEFAULT_THRESHOLD, help='Percent slower than baseline that counts as a regression (default %(default)s)')
+    args = parser.parse_args()
+
+    os.makedirs(args.workdir, exist_ok=True)
+    cases : List[str] = args.cases.split(',')
+    unknown = [name for name in cases if name not in CASES]
+    if unknown:
+        parser.error(f'unknown cases {", ".join(unknown)}')
+
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline) as open_file:
+            baseline = json.load(open_file)
+
+    if args.imports:
+        results = {f'import:{module}': run_import(module) for module in IMPORT_CASES}
+        print_import_results(results, baseline)
+        failures = [key for key, result in results.items() if IMPORT_CASES[key.split(':', 1)[1]] and result['heavy']]
+        if failures:
+            print(f'imports numpy/pandas/web modules at startup: {", ".join(failures)}')
+        finish(args, results, baseline, failures)
+        return
+
+    results = {}
+    failures = []
+    for size_text in args.sizes.split(','):
+        size = parse_size(size_text)
+        for name in cases:
+            file_name, lines = get_log(args.workdir, CASES[name][1], size, args.seed)
+            result = run_case(name, file_name, lines)
+            if result is None:
+                failures.append(f'{name}@{size_text}')
+            else:
+                results[f'{name}@{size_text}'] = result
+
+    print_results(results, baseline)
+    if failures:
+        print(f'failed: {", ".join(failures)}')
+    finish(args, results, baseline, failures)
+
+# saves the baseline if asked, and exits with 1 on failures or regressions
+def finish(args, results : Dict[str, dict], baseline : Dict[str, dict], failures : List[str]):
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as open_file:
+            json.dump(results, open_file, indent=2)
+
+    regressions = [key for key, result in results.items() if key in baseline and percent_change(result, baseline[key]) < -args.threshold]
+    if regressions:
+        print(f'slower than baseline by more than {args.threshold}%: {", ".join(regressions)}')
+    if failures or regressions:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,194 @@
+import re
+from typing import Dict, Iterable, List, Optional, Sequence
+import numpy as np
+import pandas as pd
+
+from logindex import read_lines
+from structuredlog import deidentify_path
+from instrument import metrics
+
+# Response time statistics per request path, worked out for all paths at once.  Durations are kept as two
+# numpy arrays - duration and path code - and every statistic comes from a single sort by (path, duration).
+
+PERCENTILES = (50, 90, 95, 99)
+ALL = 'all'
+
+# characters read at a time when scanning a log file
+BLOCK_SIZE = 16 * 1024 * 1024
+
+response_pattern = re.compile( '^\\d\\d\\d\\d-\\d\\d-\\d\\d.*\t(?P<duration>\\d+)ms\t\\S*\t\\d\\d\\d\t(GET|POST|HEAD|DELETE|PATCH)\t(?P<request>[^?\t]+)')
+#                                                                                                                                             ^- url up until ?
+#                                                                                                    ^- HTTP method
+#                                                                                           ^- response code
+#                                                                ^- capture 'duration' amount
+#                                ^- timestamp at beginning of line
+
+# same thing, for running over a whole block at once
+block_response_pattern = re.compile(response_pattern.pattern.replace('[^?\t]', '[^?\t\n]'), re.MULTILINE)
+
+
+# Durations of responses, with the de-identified path of each as an index into names
+class Durations:
+    def __init__(self, durations : np.ndarray, codes : np.ndarray, names : List[str]):
+        self.durations = durations
+        self.codes = codes
+        self.names = names
+
+    def __len__(self):
+        return len(self.durations)
+
+    def to_dict(self) -> Dict[str, np.ndarray]:
+        order = np.argsort(self.codes, kind='stable')
+        bounds = np.cumsum(np.bincount(self.codes, minlength=len(self.names)))
+        groups = np.split(self.durations[order], bounds[:-1])
+        return {name: group for name, group in zip(self.names, groups)}
+
+
+# Builds Durations from parallel sequences of durations and raw request paths.  Paths are de-identified once per
+# distinct path rather than once per response
+class DurationsBuilder:
+    def __init__(self):
+        self.codes_by_name : Dict[str, int] = {}
+        self.names : List[str] = []
+        self.duration_chunks : List[np.ndarray] = []
+        self.code_chunks : List[np.ndarray] = []
+
+    def add(self, durations : Sequence[int], paths : Sequence[str]):
+        if len(durations) == 0:
+            return
+        raw_codes, uniques = pd.factorize(pd.Series(paths, dtype=object))
+        unique_codes = np.array([self.code(deidentify_path(path)) for path in uniques], dtype=np.int32)
+        self.code_chunks.append(unique_codes[raw_codes])
+        self.duration_chunks.append(np.asarray(durations, dtype=np.int64))
+
+    def code(self, name : str) -> int:
+        code = self.codes_by_name.get(name)
+        if code is None:
+            code = len(self.names)
+            self.codes_by_name[name] = code
+            self.names.append(name)
+        return code
+
+    def build(self) -> Durations:
+        if not self.duration_chunks:
+            return Durations(np.array([], dtype=np.int64), np.array([], dtype=np.int32), [])
+        return Durations(np.concatenate(self.duration_chunks), np.concatenate(self.code_chunks), self.names)
+
+
+# Reads response durations from a wildfly log.  The file is read a block at a time and the pattern is run over
+# the whole block in one findall, instead of a python loop per line
+@metrics.timed('read_durations')
+def read_durations(file_name : str, start : Optional[str] = None, end : Optional[str] = None, block_size : int = BLOCK_SIZE) -> Durations:
+    builder = DurationsBuilder()
+    for block in read_blocks(file_name, start, end, block_size):
+        matches = block_response_pattern.findall(block)
+        if matches:
+            durations, _, paths = zip(*matches)
+            builder.add(np.array(durations, dtype=np.int64), paths)
+    return builder.build()
+
+# Yields chunks of the file, each ending at a line boundary
+def read_blocks(file_name : str, start : Optional[str], end : Optional[str], block_size : int) -> Iterable[str]:
+    if start or end:
+        lines = []
+        size = 0
+        for _, line in read_lines(file_name, start, end):
+            lines.append(line)
+            size += len(line)
+            if size >= block_size:
+                yield ''.join(lines)
+                lines = []
+                size = 0
+        if lines:
+            yield ''.join(lines)
+        return
+
+    with open(file_name) as open_file:
+        remainder = ''
+        while True:
+            block = open_file.read(block_size)
+            if not block:
+                break
+            block = remainder + block
+            cut = block.rfind('\n') + 1
+            remainder = block[cut:]
+            yield block[:cut]
+        if remainder:
+            yield remainder
+
+
+# Works out count, sum, max and the given percentiles for each path, plus an 'all' row when include_all is set.
+# Percentiles interpolate the same way as np.percentile
+@metrics.timed('summarize')
+def summarize(durations : Durations, percentiles : Sequence[int] = PERCENTILES, split : bool = True, include_all : bool = True) -> pd.DataFrame:
+    names = []
+    stats = []
+    if include_all:
+        names.append(ALL)
+        stats.append(group_stats(np.sort(durations.durations), np.array([len(durations)]), percentiles))
+    if split and len(durations):
+        # renumber the paths in alphabetical order so the groups come out sorted by name
+        alphabetical = np.argsort(np.array(durations.names, dtype=object))
+        rank = np.empty(len(alphabetical), dtype=np.int32)
+        rank[alphabetical] = np.arange(len(alphabetical))
+        codes = rank[durations.codes]
+        order = np.lexsort((durations.durations, codes))
+        counts = np.bincount(codes, minlength=len(durations.names))
+        present = counts > 0
+        names.extend(durations.names[code] for code in alphabetical[present])
+        stats.append(group_stats(durations.durations[order], counts[present], percentiles))
+
+    columns = ['Request'] + [percentile_name(level) for level in percentiles] + ['Max', 'Count', 'Sums']
+    if not stats:
+        return pd.DataFrame(columns=columns)
+    data = {'Request': names}
+    for column in columns[1:]:
+        data[column] = np.concatenate([group[column] for group in stats])
+    return pd.DataFrame(data, columns=columns)
+
+def percentile_name(level : int) -> str:
+    return 'Median' if level == 50 else f'P{level}'
+
+# values is sorted by group then value, counts is the size of each group in order.  Empty groups aren't allowed,
+# except for a lone empty group which comes back as zeros
+def group_stats(values : np.ndarray, counts : np.ndarray, percentiles : Sequence[int]) -> Dict[str, np.ndarray]:
+    if len(values) == 0:
+        stats = {percentile_name(level): np.zeros(len(counts)) for level in percentiles}
+        return stats | {'Max': np.zeros(len(counts), dtype=np.int64), 'Count': counts, 'Sums': np.zeros(len(counts), dtype=np.int64)}
+
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    stats = {}
+    for level in percentiles:
+        position = (counts - 1) * (level / 100.0)
+        low = np.floor(position).astype(np.int64)
+        high = np.minimum(low + 1, counts - 1)
+        low_values = values[starts + low]
+        stats[percentile_name(level)] = low_values + (values[starts + high] - low_values) * (position - low)
+    stats['Max'] = values[starts + counts - 1]
+    stats['Count'] = counts
+    stats['Sums'] = np.add.reduceat(values, starts)
+    return stats
+
+
+# Writes a summary to output_file in the given format: text, csv, json or parquet.  No file means stdout, which
+# only works for text, csv and json
+def write_summary(df : pd.DataFrame, output_file : Optional[str] = None, output_format : str = 'text'):
+    if output_format == 'text':
+        text = df.to_string(max_rows=None, index=False)
+    elif output_format == 'csv':
+        text = df.to_csv(index=False)
+    elif output_format == 'json':
+        text = df.to_json(orient='records', lines=True)
+    elif output_format == 'parquet':
+        if not output_file:
+            raise ValueError('parquet output needs an output file')
+        df.to_parquet(output_file, index=False)
+        return
+    else:
+        raise ValueError(f'unknown output format {output_format}')
+
+    if output_file:
+        with open(output_file, 'w') as open_file:
+            open_file.write(text)
+    else:
+        print(text)
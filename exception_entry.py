@@ -1,6 +1,7 @@
 
 from typing import List
 from structuredlog import process, LogEntry, LogType
+from instrument import metrics
 
 
 
@@ -18,6 +19,7 @@ class ExceptionEntry:
         self.log_entries.append(entry)
 
 
+@metrics.timed('exception_grouping')
 def get_exceptions(log_entries : List[LogEntry]) -> List[ExceptionEntry]:
     exceptions = dict()
 
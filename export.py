@@ -0,0 +1,372 @@
+import argparse
+import calendar
+from datetime import timedelta
+import json
+import os
+import shutil
+import time
+from functools import lru_cache
+from typing import Dict, List, Optional
+
+from logindex import read_lines
+from structuredlog import iter_entries, LogEntry, LogType, STREAM_WINDOW
+from aspenlog import AspenLogEntry, iter_entries as iter_aspen_entries
+from perfmon2csv import PerfmonEntry, iter_entries as iter_perfmon_entries
+from tool_entry import ToolEntry
+from hosts import LogFile, find_log_files, identify
+from instrument import metrics, add_profile_arguments, start_profile, finish_profile
+
+# Writes the parsed logs out as columnar files, Parquet or Arrow IPC, so later analysis can read them back with
+# pandas/pyarrow/duckdb instead of parsing the logs again.  Each table is a directory of hive style partitions:
+#
+#   out/server/date=2023-01-21/part-0.parquet               --partition date (the default)
+#   out/server/date=2023-01-21/hour=03/part-0.parquet       --partition hour
+#
+# so a reader only opens the days (or hours) it asks for, and only the columns it asks for - see read_table.
+# Entries are streamed from the files and written a record batch at a time, so memory stays at a few batches no
+# matter how big the logs are.  Repeated strings (level, thread, path, ...) are dictionary encoded, timestamps are
+# timestamp[ms] and durations duration[ms].  Timestamps are the wall clock time from the log, like everywhere else
+# here; Aspen's UTC offset is kept in its own column.
+#
+# pyarrow is only needed for this, so it's imported when an export starts rather than up here.
+
+TABLE_NAMES = ['server', 'aspen', 'tools', 'perfmon']
+FORMATS = {'parquet': 'parquet', 'arrow': 'arrow'}      # format -> file extension
+PARTITIONS = ['date', 'hour', 'none']
+BATCH_ROWS = 50000
+# partitions with rows waiting to be written, and files kept open, at most.  Logs are close to time order, so
+# usually only one or two are in use at a time
+MAX_OPEN_PARTITIONS = 8
+
+# column name -> kind, in the order they're written.  'category' columns are dictionary encoded strings
+TABLE_COLUMNS = {
+    'server': {
+        'host': 'category', 'timestamp': 'timestamp', 'line_number': 'int64', 'level': 'category', 'source': 'category',
+        'thread': 'category', 'type': 'category', 'message': 'string', 'lines': 'lines', 'concurrent_jobs': 'int32',
+        'tenant': 'category', 'duration': 'duration', 'ipaddr': 'category', 'response_code': 'int16', 'method': 'category',
+        'path': 'string', 'deidentified_path': 'category', 'sessionid': 'string',
+    },
+    'aspen': {
+        'host': 'category', 'timestamp': 'timestamp', 'utc_offset': 'category', 'level': 'category', 'source': 'category',
+        'logtype': 'category', 'id': 'category', 'message': 'string', 'lines': 'lines',
+    },
+    'tools': {
+        'host': 'category', 'timestamp': 'timestamp', 'type': 'category', 'deployment_id': 'string', 'tool_id': 'string',
+        'tool_name': 'category', 'location': 'category', 'duration': 'duration', 'parameters': 'string',
+    },
+    # one row per counter value, since each perfmon counter has its own set of values
+    'perfmon': {
+        'host': 'category', 'timestamp': 'timestamp', 'counter_name': 'category', 'sample_start': 'timestamp',
+        'sample_end': 'timestamp', 'name': 'category', 'value': 'float64', 'extra': 'string',
+    },
+}
+
+# pads a partial timestamp out to the first or last millisecond it covers
+TIMESTAMP_FIRST = '0000-01-01 00:00:00,000'
+TIMESTAMP_LAST = '9999-12-31 23:59:59,999'
+
+
+def require_pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        raise ImportError('exporting needs pyarrow: pip install pyarrow') from None
+
+def arrow_type(kind : str):
+    import pyarrow as pa
+    return {
+        'category': pa.dictionary(pa.int32(), pa.string()),
+        'string': pa.string(),
+        'lines': pa.list_(pa.string()),
+        'timestamp': pa.timestamp('ms'),
+        'duration': pa.duration('ms'),
+        'int16': pa.int16(),
+        'int32': pa.int32(),
+        'int64': pa.int64(),
+        'float64': pa.float64(),
+    }[kind]
+
+def table_schema(table : str):
+    import pyarrow as pa
+    return pa.schema([(name, arrow_type(kind)) for name, kind in TABLE_COLUMNS[table].items()])
+
+
+@lru_cache(maxsize=4096)
+def epoch_seconds(timestamp : str) -> int:
+    return calendar.timegm(time.strptime(timestamp, '%Y-%m-%d %H:%M:%S'))
+
+# '2023-01-21 03:00:00,030' (or with a '.') to epoch milliseconds.  Timestamps within the same second share the
+# strptime, which is most of the cost
+def to_milliseconds(timestamp : str) -> int:
+    return epoch_seconds(timestamp[:19]) * 1000 + int(timestamp[20:23] or 0)
+
+# partition directory for a timestamp, e.g. 'date=2023-01-21/hour=03'
+def partition_path(timestamp : str, partition : str) -> str:
+    if partition == 'hour':
+        return f'date={timestamp[:10]}/hour={timestamp[11:13]}'
+    if partition == 'date':
+        return f'date={timestamp[:10]}'
+    return ''
+
+def optional_int(value) -> Optional[int]:
+    if isinstance(value, (int, float)):
+        return int(value)
+    if isinstance(value, str) and value.isdigit():
+        return int(value)
+    return None
+
+def optional_str(value) -> Optional[str]:
+    return None if value is None else str(value)
+
+
+# One table's partitions.  Rows are kept per partition until there's a batch of them, then written to that
+# partition's open file
+class TableWriter:
+    def __init__(self, output : str, table : str, file_format : str = 'parquet', partition : str = 'date', batch_rows : int = BATCH_ROWS):
+        self.directory = os.path.join(output, table)
+        self.table = table
+        self.file_format = file_format
+        self.partition = partition
+        self.batch_rows = batch_rows
+        self.schema = table_schema(table)
+        self.pending : Dict[str, list] = {}
+        self.files : Dict[str, object] = {}     # partition -> open writer, least recently used first
+        self.file_counts : Dict[str, int] = {}
+        self.rows = 0
+        self.files_written = 0
+
+    def add(self, timestamp : str, row : tuple):
+        key = partition_path(timestamp, self.partition)
+        rows = self.pending.get(key)
+        if rows is None:
+            rows = self.pending[key] = []
+            if len(self.pending) > MAX_OPEN_PARTITIONS:
+                self.flush(next(iter(self.pending)))
+        rows.append(row)
+        if len(rows) >= self.batch_rows:
+            self.flush(key)
+
+    def flush(self, key : str):
+        import pyarrow as pa
+        rows = self.pending.pop(key)
+        columns = zip(*rows)
+        batch = pa.RecordBatch.from_arrays([pa.array(column, type=field.type) for column, field in zip(columns, self.schema)], schema=self.schema)
+        with metrics.stage('export_write'):
+            if self.file_format == 'parquet':
+                self.file(key).write_batch(batch)
+            else:
+                # an Arrow IPC file can only have one dictionary per column, and each batch has its own
+                with self.open(key) as writer:
+                    writer.write_batch(batch)
+        self.rows += len(rows)
+
+    def file(self, key : str):
+        writer = self.files.pop(key, None)
+        if writer is None:
+            writer = self.open(key)
+            if len(self.files) >= MAX_OPEN_PARTITIONS:
+                self.files.pop(next(iter(self.files))).close()
+        self.files[key] = writer
+        return writer
+
+    # a partition that's closed and opened again gets another part file, rather than appending
+    def open(self, key : str):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        directory = os.path.join(self.directory, key)
+        os.makedirs(directory, exist_ok=True)
+        part = self.file_counts.get(key, 0)
+        self.file_counts[key] = part + 1
+        self.files_written += 1
+        path = os.path.join(directory, f'part-{part}.{FORMATS[self.file_format]}')
+        if self.file_format == 'parquet':
+            return pq.ParquetWriter(path, self.schema, compression='zstd')
+        return pa.ipc.new_file(path, self.schema)
+
+    def close(self):
+        for key in list(self.pending):
+            self.flush(key)
+        for writer in self.files.values():
+            writer.close()
+        self.files = {}
+        metrics.count(f'export_{self.table}_rows', self.rows)
+
+
+# Streams log files into a TableWriter per table
+class Exporter:
+    def __init__(self, output : str, tables : List[str] = TABLE_NAMES, file_format : str = 'parquet', partition : str = 'date',
+                 batch_rows : int = BATCH_ROWS, window : int = STREAM_WINDOW):
+        require_pyarrow()
+        self.writers = {table: TableWriter(output, table, file_format, partition, batch_rows) for table in tables}
+        self.window = window
+
+    # tools come out of the server log, so it's read if either table is wanted
+    @metrics.timed('export_server')
+    def add_server_log(self, file_name : str, host : str, start : Optional[str] = None, end : Optional[str] = None):
+        server = self.writers.get('server')
+        tools = self.writers.get('tools')
+        if not server and not tools:
+            return
+        running = 0
+        for entry in iter_entries(read_lines(file_name, start, end), self.window):
+            entry.host = host
+            if ToolEntry.is_tool(entry):
+                tool_entry = ToolEntry(entry)
+                running += 1 if tool_entry.is_start() else -1
+                if tools:
+                    tools.add(entry.timestamp, tool_row(tool_entry))
+            entry.concurrent_jobs = running
+            if server:
+                server.add(entry.timestamp, server_row(entry))
+
+    @metrics.timed('export_aspen')
+    def add_aspen_log(self, file_name : str, host : str, start : Optional[str] = None, end : Optional[str] = None):
+        aspen = self.writers.get('aspen')
+        if not aspen:
+            return
+        for entry in iter_aspen_entries(read_lines(file_name, start, end)):
+            entry.host = host
+            aspen.add(entry.timestamp, aspen_row(entry))
+
+    @metrics.timed('export_perfmon')
+    def add_perfmon_log(self, file_name : str, host : str, start : Optional[str] = None, end : Optional[str] = None):
+        perfmon = self.writers.get('perfmon')
+        if not perfmon:
+            return
+        for entry in iter_perfmon_entries(line for _, line in read_lines(file_name, start, end)):
+            timestamp = f'{entry.log_date} {entry.log_time}'
+            for row in perfmon_rows(entry, host):
+                perfmon.add(timestamp, row)
+
+    def add(self, log_file : LogFile, start : Optional[str] = None, end : Optional[str] = None):
+        {'server': self.add_server_log, 'aspen': self.add_aspen_log, 'perfmon': self.add_perfmon_log}[log_file.kind](log_file.file_name, log_file.host, start, end)
+
+    def close(self) -> Dict[str, TableWriter]:
+        for writer in self.writers.values():
+            writer.close()
+        return self.writers
+
+
+def server_row(entry : LogEntry) -> tuple:
+    is_call = entry.type == LogType.REQUEST or entry.type == LogType.RESPONSE
+    return (entry.host, to_milliseconds(entry.timestamp), entry.line_number, entry.level, entry.source, entry.thread,
+            entry.type.name, entry.message, entry.lines, entry.concurrent_jobs,
+            entry.tenant if is_call else None,
+            entry.duration if entry.type == LogType.RESPONSE else None,
+            entry.ipaddr if is_call else None,
+            optional_int(entry.response_code) if entry.type == LogType.RESPONSE else None,
+            entry.method if is_call else None,
+            entry.path if is_call else None,
+            entry.get_deidentified_path() if is_call else None,
+            entry.sessionid if is_call else None)
+
+# Aspen timestamps are '2023-01-21 03:00:00 -0500'
+def aspen_row(entry : AspenLogEntry) -> tuple:
+    return (entry.host, to_milliseconds(entry.timestamp[:19]), entry.timestamp[20:], entry.level, entry.source, entry.logtype,
+            entry.id, entry.message, entry.lines)
+
+def tool_row(tool_entry : ToolEntry) -> tuple:
+    entry = tool_entry.entry
+    return (entry.host, to_milliseconds(entry.timestamp), tool_entry.type.name, optional_str(tool_entry.deploymentId),
+            optional_str(tool_entry.toolId), optional_str(tool_entry.toolName), optional_str(tool_entry.location),
+            optional_int(tool_entry.duration), json.dumps(tool_entry.parameters))
+
+# names go name, name_extra, name, name_extra, ...
+def perfmon_rows(entry : PerfmonEntry, host : str) -> List[tuple]:
+    timestamp = to_milliseconds(f'{entry.log_date} {entry.log_time}')
+    sample_start = entry.sample_start
+    # both sample times get the log line's date, so a sample that spans midnight started the day before
+    if sample_start and entry.sample_end and sample_start > entry.sample_end:
+        sample_start -= timedelta(days=1)
+    return [(host, timestamp, entry.counter_name, sample_start, entry.sample_end, name, entry.entries[name],
+             entry.entries[extra].strip()) for name, extra in zip(entry.names[::2], entry.names[1::2])]
+
+
+# Log files from a mix of data directories (see hosts.find_log_files) and single files
+def find_files(paths : List[str]) -> List[LogFile]:
+    log_files = []
+    for path in paths:
+        if os.path.isdir(path):
+            log_files.extend(find_log_files(path))
+        else:
+            log_files.append(identify(os.path.dirname(path) or '.', path))
+    return log_files
+
+@metrics.timed('export')
+def export(log_files : List[LogFile], output : str, tables : List[str] = TABLE_NAMES, file_format : str = 'parquet',
+           partition : str = 'date', start : Optional[str] = None, end : Optional[str] = None,
+           batch_rows : int = BATCH_ROWS) -> Dict[str, TableWriter]:
+    exporter = Exporter(output, tables, file_format, partition, batch_rows)
+    for log_file in log_files:
+        if log_file.kind:
+            exporter.add(log_file, start, end)
+    return exporter.close()
+
+
+# One exported table as a pandas DataFrame, reading only the columns asked for and, with start/end, only the
+# partitions that overlap them.  start and end are like --from/--to: '2023-01-21 03:00', end inclusive
+def read_table(output : str, table : str, columns : Optional[List[str]] = None, start : Optional[str] = None,
+               end : Optional[str] = None, file_format : str = 'parquet'):
+    require_pyarrow()
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+    directory = os.path.join(output, table)
+    dataset = ds.dataset(directory, format='parquet' if file_format == 'parquet' else 'ipc', partitioning='hive')
+    # the date partition (a string) is what skips whole directories, the timestamp does the rest
+    partitioned = 'date' in dataset.schema.names
+    conditions = []
+    if start:
+        first = start + TIMESTAMP_FIRST[len(start):]
+        conditions.append(ds.field('timestamp') >= pa.scalar(to_milliseconds(first), pa.timestamp('ms')))
+        if partitioned:
+            conditions.append(ds.field('date') >= first[:10])
+    if end:
+        last = end + TIMESTAMP_LAST[len(end):]
+        conditions.append(ds.field('timestamp') <= pa.scalar(to_milliseconds(last), pa.timestamp('ms')))
+        if partitioned:
+            conditions.append(ds.field('date') <= last[:10])
+    condition = None
+    for next_condition in conditions:
+        condition = next_condition if condition is None else condition & next_condition
+    return dataset.to_table(columns=columns, filter=condition).to_pandas()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Writes parsed logs to Parquet or Arrow files, partitioned by time')
+    parser.add_argument('output', help='Directory to write to, one subdirectory per table')
+    parser.add_argument('paths', nargs='+', help='Log files, or data directories laid out as grablog writes them')
+    parser.add_argument('--tables', action='store', default=','.join(TABLE_NAMES), help='Comma separated tables to write (default %(default)s)')
+    parser.add_argument('--format', dest='file_format', choices=list(FORMATS), default='parquet', help='File format (default %(default)s)')
+    parser.add_argument('--partition', choices=PARTITIONS, default='date', help='Split each table into a directory per day or hour (default %(default)s)')
+    parser.add_argument('--batch-rows', action='store', type=int, default=BATCH_ROWS, help='Rows per record batch (default %(default)s)')
+    parser.add_argument('--overwrite', action='store_true', help='Remove tables already in the output directory first')
+    parser.add_argument('--from', dest='start', action='store', required=False, help='Only read entries at or after this time, e.g. "2023-01-21 03:00"')
+    parser.add_argument('--to', dest='end', action='store', required=False, help='Only read entries up to this time, inclusive, e.g. "2023-01-21 03:05"')
+    add_profile_arguments(parser)
+    args = parser.parse_args()
+
+    tables = [table.strip() for table in args.tables.split(',') if table.strip()]
+    unknown = [table for table in tables if table not in TABLE_NAMES]
+    if unknown:
+        parser.error(f'unknown tables: {", ".join(unknown)} (choose from {", ".join(TABLE_NAMES)})')
+    existing = [table for table in tables if os.path.exists(os.path.join(args.output, table))]
+    if existing and not args.overwrite:
+        parser.error(f'{", ".join(existing)} already in {args.output}, use --overwrite to replace')
+    try:
+        require_pyarrow()
+    except ImportError as error:
+        parser.error(str(error))
+    for table in existing:
+        shutil.rmtree(os.path.join(args.output, table))
+
+    profiler = start_profile(args)
+    log_files = find_files(args.paths)
+    writers = export(log_files, args.output, tables, args.file_format, args.partition, args.start, args.end, args.batch_rows)
+    for table, writer in writers.items():
+        print(f'{table:<8} {writer.rows:>12,} rows  {writer.files_written:>5,} files  {writer.directory}')
+    finish_profile(args, profiler)
+
+
+if __name__ == "__main__":
+    main()
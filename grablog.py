@@ -41,24 +41,42 @@ def get_server_files(context: Context, ftp, cluster_dir: str, server_dir: str):
     ftp.chdir("..")
 
 
+# finds the server's directory in the first cluster that has it and pulls its files
+def get_server(context: Context, ftp):
+    data = ftp.listdir()
+    cluster_dirs = [name for name in data if name.startswith('azurec')]
+    for cluster_dir in cluster_dirs:
+        ftp.chdir(cluster_dir)
+        data = ftp.listdir()
+        server_dirs = [name for name in data if name.endswith(context.server)]
+
+        for server_dir in server_dirs:
+            get_server_files(context, ftp, cluster_dir, server_dir)
+        ftp.chdir('..')
+        if server_dirs:
+            break
 
 
 def main():
 
     # command line arguments
     parser = argparse.ArgumentParser(description='Grabs Aspen log files')
-    parser.add_argument('--server', action='store', default='', required=True, help='Server name, something like app63 or rpt30.')
+    parser.add_argument('--server', action='store', default='', required=True, help='Server name, something like app63 or rpt30.  Comma separate several servers, like app63,app64.')
     parser.add_argument('--output', action='store', default='.', required=False, help='Local directory to write files to.')
+    parser.add_argument('--by-host', action='store_true', required=False, help='Write each server\'s files to its own subdirectory of --output, which logweb.py reads as one host per directory.  Always on with more than one server.')
     parser.add_argument('--time', action='store', default='10 min ago', required=False, help='Incident time.  Can be human readable like "30 min ago" or "2 days ago"')
     parser.add_argument('--test', action='store_true', required=False, help='Use this to list files rather than pull them down')
     args = parser.parse_args()
 
     incident_time : datetime = dateparser.parse(args.time).astimezone()
 
-    context = Context(args.server, args.output, incident_time, args.test)
+    servers = [server.strip() for server in args.server.split(',') if server.strip()]
+    by_host = args.by_host or len(servers) > 1
+    contexts = [Context(server, os.path.join(args.output, server) if by_host else args.output, incident_time, args.test) for server in servers]
 
-    #make sure directory exists
-    Path(context.output).mkdir(parents=True, exist_ok=True)
+    #make sure directories exist
+    for context in contexts:
+        Path(context.output).mkdir(parents=True, exist_ok=True)
 
     #ftp credentials
     load_dotenv()
@@ -72,18 +90,8 @@ def main():
     cnopts = pysftp.CnOpts()
     cnopts.hostkeys = None  
     with pysftp.Connection(host=ftp_host, username=ftp_user, password=ftp_password, cnopts=cnopts) as ftp:
-        data = ftp.listdir()
-        cluster_dirs = [name for name in data if name.startswith('azurec')]
-        for cluster_dir in cluster_dirs:
-            ftp.chdir(cluster_dir)
-            data = ftp.listdir()
-            server_dirs = [name for name in data if name.endswith(args.server)]
-
-            for server_dir in server_dirs:
-                get_server_files(context, ftp, cluster_dir, server_dir)
-            if server_dirs:
-                break
-            ftp.chdir('..')
+        for context in contexts:
+            get_server(context, ftp)
 
 
 
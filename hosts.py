@@ -0,0 +1,123 @@
+import os
+import re
+from collections import namedtuple
+from glob import glob
+from typing import Dict, Iterable, List
+
+from logindex import INDEX_SUFFIX
+from structuredlog import LogEntry, LogType
+from streaming import StreamReport
+
+# Logs from several app servers, each tagged with the server (host) it came from.  The host comes from the layout
+# of the data directory, which is what grablog writes:
+#
+#   data/app63/server.log        host is the subdirectory
+#   data/app63_server.log        or a prefix on the file name, before _ or -
+#   data/server.log              otherwise it's DEFAULT_HOST
+#
+# Per host numbers are kept as HostStats, which merge, so each file can be summarized on its own (in a worker
+# process, say) and the results added up per host afterwards.
+
+DEFAULT_HOST = 'local'
+
+# which log each kind of file is, by file name (after any host prefix)
+LOG_PATTERNS = {
+    'server': re.compile(r'^server\.log'),
+    'aspen': re.compile(r'^Aspen.*\.log'),
+    'perfmon': re.compile(r'^perfmon4j\.log'),
+}
+host_prefix_pattern = re.compile(r'^(?P<host>[A-Za-z0-9.]+)[_-](?P<name>(server\.log|Aspen|perfmon4j\.log).*)$')
+
+# a log file found under the data directory
+LogFile = namedtuple('LogFile', 'host kind file_name')
+
+
+# Splits a file name into host and log kind.  kind is None for files that aren't logs we know about
+def identify(data : str, file_name : str) -> LogFile:
+    relative = os.path.relpath(file_name, data)
+    directory, name = os.path.split(relative)
+    host = directory.split(os.sep)[0] if directory else DEFAULT_HOST
+    match = host_prefix_pattern.match(name)
+    if match:
+        if not directory:
+            host = match.group('host')
+        name = match.group('name')
+    kind = next((kind for kind, pattern in LOG_PATTERNS.items() if pattern.match(name)), None)
+    return LogFile(host, kind, file_name)
+
+# All the logs in data and its immediate subdirectories, sorted by host then file name
+def find_log_files(data : str) -> List[LogFile]:
+    file_names = glob(os.path.join(data, '*')) + glob(os.path.join(data, '*', '*'))
+    log_files = [identify(data, file_name) for file_name in file_names
+                 if os.path.isfile(file_name) and not file_name.endswith(INDEX_SUFFIX)]
+    return sorted((log_file for log_file in log_files if log_file.kind), key=lambda log_file: (log_file.host, log_file.file_name))
+
+def files_of_kind(log_files : Iterable[LogFile], kind : str) -> List[str]:
+    return [log_file.file_name for log_file in log_files if log_file.kind == kind]
+
+def host_by_file(log_files : Iterable[LogFile]) -> Dict[str, str]:
+    return {log_file.file_name: log_file.host for log_file in log_files}
+
+
+# StreamReport for one host, plus 5xx responses
+class HostStats(StreamReport):
+    def __init__(self, host : str):
+        super().__init__()
+        self.host = host
+        self.server_errors = 0
+
+    def add(self, entry : LogEntry):
+        super().add(entry)
+        if entry.type == LogType.RESPONSE and entry.response_code.startswith('5'):
+            self.server_errors += 1
+
+    def merge(self, other : 'HostStats'):
+        super().merge(other)
+        self.server_errors += other.server_errors
+
+    def responses(self) -> int:
+        return self.durations.count
+
+    def error_percent(self) -> float:
+        return 100.0 * self.server_errors / self.responses() if self.responses() else 0.0
+
+    # exceptions per 1000 responses, so busy and quiet hosts compare
+    def exception_rate(self) -> float:
+        return 1000.0 * self.exceptions.total / self.responses() if self.responses() else 0.0
+
+    def top_exception(self) -> str:
+        top = self.exceptions.most_common(1)
+        return top[0][0].split('\n')[0] if top else ''
+
+
+# values compared across hosts on the /hosts page.  Bigger is worse for all of them
+HOST_COLUMNS = {
+    'p95': lambda stats: stats.durations.percentile(95),
+    'error_percent': HostStats.error_percent,
+    'exception_rate': HostStats.exception_rate,
+    'max_running': lambda stats: stats.tools.max_running,
+}
+# a host is flagged when a value is this many times the median over all hosts
+OUTLIER_FACTOR = 1.5
+
+# host -> names of the HOST_COLUMNS where it stands out from the rest.  Needs at least 3 hosts to mean anything
+def find_outliers(hosts : Dict[str, HostStats]) -> Dict[str, set]:
+    outliers = {host: set() for host in hosts}
+    if len(hosts) < 3:
+        return outliers
+    for name, value in HOST_COLUMNS.items():
+        values = {host: value(stats) for host, stats in hosts.items()}
+        ordered = sorted(values.values())
+        median = ordered[len(ordered) // 2]
+        for host, host_value in values.items():
+            if host_value > 0 and host_value > OUTLIER_FACTOR * median:
+                outliers[host].add(name)
+    return outliers
+
+
+# Adds up per file stats into one HostStats per host, leaving the originals alone
+def merge_by_host(stats : Iterable[HostStats]) -> Dict[str, HostStats]:
+    hosts : Dict[str, HostStats] = {}
+    for file_stats in stats:
+        hosts.setdefault(file_stats.host, HostStats(file_stats.host)).merge(file_stats)
+    return dict(sorted(hosts.items()))
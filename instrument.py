@@ -0,0 +1,215 @@
+from collections import Counter
+from contextlib import contextmanager
+from functools import wraps
+import os
+import sys
+import threading
+import time
+from typing import Dict, List, Optional
+
+# Timing and counters for the parsing/analysis stages, latency for logweb routes, and a sampling profiler.  The
+# CLI tools print these with --profile, logweb serves them from /metrics.  Everything records into the module level
+# 'metrics' object.
+
+
+# total and longest time for something.  count is usually calls, but for the per line stages it's lines
+class Timing:
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, seconds : float, count : int = 1):
+        self.count += count
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def to_dict(self) -> dict:
+        return {'count': self.count, 'seconds': round(self.total, 6), 'max_seconds': round(self.max, 6)}
+
+
+class Metrics:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.stages : Dict[str, Timing] = {}
+        self.routes : Dict[str, Timing] = {}
+        self.counters = Counter()
+        # per line timings (read / regex_match / entry_build) cost a few clock reads per line, so they're only kept
+        # when profiling
+        self.detailed = False
+        self.profiler : Optional['SamplingProfiler'] = None
+
+    def add_time(self, name : str, seconds : float, count : int = 1):
+        with self.lock:
+            self.stages.setdefault(name, Timing()).add(seconds, count)
+
+    def add_route_time(self, route : str, seconds : float):
+        with self.lock:
+            self.routes.setdefault(route, Timing()).add(seconds)
+
+    def count(self, name : str, amount : int = 1):
+        with self.lock:
+            self.counters[name] += amount
+
+    @contextmanager
+    def stage(self, name : str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(name, time.perf_counter() - start)
+
+    # decorator version of stage
+    def timed(self, name : str):
+        def decorator(function):
+            @wraps(function)
+            def wrapper(*args, **kwargs):
+                with self.stage(name):
+                    return function(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def clear(self):
+        with self.lock:
+            self.stages.clear()
+            self.routes.clear()
+            self.counters.clear()
+
+    # Adds in the stages and counters from another process's to_dict(), e.g. a worker that parsed a file
+    def merge(self, values : dict):
+        with self.lock:
+            for name, values_timing in values.get('stages', {}).items():
+                timing = self.stages.setdefault(name, Timing())
+                timing.count += values_timing['count']
+                timing.total += values_timing['seconds']
+                timing.max = max(timing.max, values_timing['max_seconds'])
+            self.counters.update(values.get('counters', {}))
+
+    def to_dict(self) -> dict:
+        with self.lock:
+            values = {
+                'stages': {name: timing.to_dict() for name, timing in self.stages.items()},
+                'counters': dict(self.counters),
+                'routes': {name: timing.to_dict() for name, timing in self.routes.items()},
+            }
+        if self.profiler:
+            values['profile'] = self.profiler.top()
+        return values
+
+    # Prometheus text format
+    def to_prometheus(self, prefix : str = 'logprocessing') -> str:
+        lines = []
+        with self.lock:
+            for kind, timings in (('stage', self.stages), ('route', self.routes)):
+                lines.append(f'# TYPE {prefix}_{kind}_seconds_total counter')
+                lines.extend(f'{prefix}_{kind}_seconds_total{{{kind}="{escape(name)}"}} {timing.total:.6f}' for name, timing in timings.items())
+                lines.append(f'# TYPE {prefix}_{kind}_calls_total counter')
+                lines.extend(f'{prefix}_{kind}_calls_total{{{kind}="{escape(name)}"}} {timing.count}' for name, timing in timings.items())
+                lines.append(f'# TYPE {prefix}_{kind}_seconds_max gauge')
+                lines.extend(f'{prefix}_{kind}_seconds_max{{{kind}="{escape(name)}"}} {timing.max:.6f}' for name, timing in timings.items())
+            lines.append(f'# TYPE {prefix}_count_total counter')
+            lines.extend(f'{prefix}_count_total{{name="{escape(name)}"}} {value}' for name, value in self.counters.items())
+        return '\n'.join(lines) + '\n'
+
+    def report(self) -> str:
+        lines = [f'{"stage":<24} {"calls":>8} {"seconds":>10} {"max":>10}']
+        with self.lock:
+            for name, timing in sorted(self.stages.items(), key=lambda item: -item[1].total):
+                lines.append(f'{name:<24} {timing.count:>8,} {timing.total:>10.3f} {timing.max:>10.3f}')
+            for name, value in sorted(self.counters.items()):
+                lines.append(f'{name:<24} {value:>8,}')
+        return '\n'.join(lines)
+
+
+def escape(label : str) -> str:
+    return label.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+metrics = Metrics()
+
+
+# Samples the stacks of all the other threads every interval seconds.  Cheap enough to leave running in logweb.
+class SamplingProfiler:
+    def __init__(self, interval : float = 0.005):
+        self.interval = interval
+        self.stacks = Counter()
+        self.samples = 0
+        self.lock = threading.Lock()
+        self.running = False
+        self.thread = threading.Thread(target=self.run, name='sampling-profiler', daemon=True)
+
+    def start(self):
+        self.running = True
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+        self.thread.join()
+
+    def run(self):
+        own_id = threading.get_ident()
+        while self.running:
+            time.sleep(self.interval)
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f'{os.path.basename(code.co_filename)}:{code.co_name}')
+                    frame = frame.f_back
+                with self.lock:
+                    self.stacks[';'.join(reversed(stack))] += 1
+                    self.samples += 1
+
+    # Functions seen most often on the stack.  'self' counts samples where the function was running, 'total'
+    # counts samples where it was anywhere on the stack
+    def top(self, limit : int = 20) -> List[dict]:
+        own = Counter()
+        total = Counter()
+        with self.lock:
+            stacks = list(self.stacks.items())
+            samples = self.samples
+        for stack, count in stacks:
+            functions = stack.split(';')
+            own[functions[-1]] += count
+            for function in set(functions):
+                total[function] += count
+        return [{'function': function, 'self': own[function], 'total': count, 'percent': round(100.0 * count / samples, 1) if samples else 0.0}
+                for function, count in total.most_common(limit)]
+
+    # one 'a;b;c count' line per stack, the format flamegraph.pl and speedscope read
+    def collapsed(self) -> str:
+        with self.lock:
+            return ''.join(f'{stack} {count}\n' for stack, count in self.stacks.most_common())
+
+    def report(self, limit : int = 20) -> str:
+        lines = [f'{"function":<60} {"self":>8} {"total":>8} {"%":>6}']
+        for row in self.top(limit):
+            lines.append(f'{row["function"][:60]:<60} {row["self"]:>8,} {row["total"]:>8,} {row["percent"]:>6.1f}')
+        return '\n'.join(lines)
+
+
+def add_profile_arguments(parser):
+    parser.add_argument('--profile', action='store_true', required=False, help='Print per stage timings and a sampling profile to stderr')
+    parser.add_argument('--profile-output', action='store', required=False, help='With --profile, also write the sampled stacks here in collapsed (flamegraph) format')
+
+# Call with the parsed arguments once they're known.  Returns the profiler, if --profile was given
+def start_profile(args) -> Optional[SamplingProfiler]:
+    if not args.profile:
+        return None
+    metrics.detailed = True
+    metrics.profiler = SamplingProfiler()
+    metrics.profiler.start()
+    return metrics.profiler
+
+def finish_profile(args, profiler : Optional[SamplingProfiler]):
+    if profiler is None:
+        return
+    profiler.stop()
+    print(metrics.report(), file=sys.stderr)
+    print(file=sys.stderr)
+    print(profiler.report(), file=sys.stderr)
+    if args.profile_output:
+        with open(args.profile_output, 'w') as open_file:
+            open_file.write(profiler.collapsed())
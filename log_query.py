@@ -0,0 +1,121 @@
+import json
+from typing import Dict, Iterator, List, Optional
+import numpy as np
+import pandas as pd
+
+from structuredlog import LogEntry
+
+# fields that can be asked for with ?fields=.  Entries that aren't requests/responses have '' for the request fields
+# (null for duration)
+FIELDS = ['host', 'line_number', 'timestamp', 'level', 'source', 'thread', 'type', 'message', 'tenant', 'duration',
+          'ipaddr', 'response_code', 'method', 'path', 'sessionid']
+
+# filters that are compared against a whole column.  These are kept as categoricals so the compare is on small ints
+CATEGORY_FILTERS = ['host', 'level', 'thread', 'tenant', 'path', 'type']
+
+MAX_LIMIT = 100000
+
+# just past any character that shows up in a timestamp, so 'to' + END_OF_PREFIX sorts after every timestamp that
+# starts with 'to'
+END_OF_PREFIX = '\x7f'
+
+
+class QueryError(Exception):
+    pass
+
+
+# Columnar copy of a snapshot's log entries so filters can be worked out with numpy instead of a python loop over
+# the entries.  Entries are sorted by timestamp, so time range is a binary search.  Make one per snapshot.
+class LogQueryIndex:
+    def __init__(self, log_entries : List[LogEntry]):
+        self.log_entries = log_entries
+        self.timestamps = np.array([entry.timestamp for entry in log_entries], dtype=str)
+        self.columns = {
+            'host': pd.Categorical([entry.host for entry in log_entries]),
+            'level': pd.Categorical([entry.level for entry in log_entries]),
+            'thread': pd.Categorical([entry.thread for entry in log_entries]),
+            'tenant': pd.Categorical([getattr(entry, 'tenant', '') for entry in log_entries]),
+            'path': pd.Categorical([entry.get_deidentified_path() or '' for entry in log_entries]),
+            'type': pd.Categorical([entry.type.name for entry in log_entries]),
+        }
+        self.status = pd.Categorical([getattr(entry, 'response_code', '') for entry in log_entries])
+        self.duration = np.array([entry.duration if getattr(entry, 'duration', None) not in (None, '') else np.nan
+                                  for entry in log_entries], dtype=float)
+
+    def __len__(self):
+        return len(self.log_entries)
+
+    # Returns positions (into log_entries) of the entries that match, in timestamp order, starting at position cursor
+    def select(self, filters : Dict[str, str], cursor : int = 0) -> np.ndarray:
+        low = max(cursor, 0)
+        high = len(self)
+        if filters.get('from'):
+            low = max(low, int(np.searchsorted(self.timestamps, filters['from'], side='left')))
+        if filters.get('to'):
+            high = int(np.searchsorted(self.timestamps, filters['to'] + END_OF_PREFIX, side='left'))
+        if low >= high:
+            return np.array([], dtype=np.int64)
+
+        # everything from here on only looks at the [low, high) slice
+        mask = np.ones(high - low, dtype=bool)
+        for name in CATEGORY_FILTERS:
+            if filters.get(name):
+                mask &= category_mask(self.columns[name], filters[name].split(','), low, high)
+        if filters.get('status'):
+            mask &= self.status_mask(filters['status'].split(','), low, high)
+        if filters.get('min_duration') is not None:
+            with np.errstate(invalid='ignore'):
+                mask &= self.duration[low:high] >= float(filters['min_duration'])
+        return np.flatnonzero(mask) + low
+
+    # status can be exact codes (500) or classes (5xx)
+    def status_mask(self, values : List[str], low : int, high : int) -> np.ndarray:
+        categories = self.status.categories
+        wanted = [category for category in categories
+                  if any(category == value or (value.endswith('xx') and category[:1] == value[:1]) for value in values)]
+        return category_mask(self.status, wanted, low, high)
+
+    def records(self, positions : np.ndarray, fields : List[str]) -> Iterator[dict]:
+        for position in positions:
+            entry = self.log_entries[position]
+            yield {field: field_value(entry, field) for field in fields}
+
+
+def category_mask(column : pd.Categorical, values : List[str], low : int, high : int) -> np.ndarray:
+    codes = column.categories.get_indexer(values)
+    codes = codes[codes >= 0]
+    return np.isin(column.codes[low:high], codes)
+
+
+def field_value(entry : LogEntry, field : str):
+    if field == 'type':
+        return entry.type.name
+    value = getattr(entry, field, '')
+    if field == 'duration' and value == '':
+        return None
+    return value
+
+
+def parse_fields(fields : Optional[str]) -> List[str]:
+    if not fields:
+        return FIELDS
+    names = [name.strip() for name in fields.split(',') if name.strip()]
+    unknown = [name for name in names if name not in FIELDS]
+    if unknown:
+        raise QueryError(f'unknown fields: {", ".join(unknown)}')
+    return names
+
+
+# Runs a query and returns (ndjson lines, next cursor or None, number of matches)
+def run_query(index : LogQueryIndex, args : Dict[str, str]):
+    fields = parse_fields(args.get('fields'))
+    limit = min(int(args.get('limit') or 1000), MAX_LIMIT)
+    cursor = int(args.get('cursor') or 0)
+    positions = index.select(args, cursor)
+    next_cursor = None
+    if len(positions) > limit:
+        next_cursor = int(positions[limit])
+    matches = len(positions)
+    positions = positions[:limit]
+    lines = (json.dumps(record) + '\n' for record in index.records(positions, fields))
+    return lines, next_cursor, matches
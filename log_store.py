@@ -0,0 +1,286 @@
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from itertools import islice
+import multiprocessing
+import os
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+from structuredlog import process_lines, LogEntry
+from aspenlog import process_lines as process_aspen_lines, AspenLogEntry
+from exception_entry import get_exceptions
+from tool_entry import get_tools_and_mark_log_entries_with_concurrent_jobs
+from hosts import DEFAULT_HOST, HostStats, merge_by_host
+from logindex import read_lines
+from instrument import metrics
+
+# Everything the web pages show, computed from the entries loaded so far.  A snapshot's lists and aggregates aren't
+# changed once it's published, so a route can use one while the loader builds the next.  The entries themselves are
+# shared with later snapshots, though: while a file is still loading an entry can get more continuation lines, and
+# each build marks concurrent_jobs on the entries again.  Builds take turns (LogStore.build_lock), so two of them
+# never mark the same entries at once, and versions are never repeated.
+LogSnapshot = namedtuple('LogSnapshot', 'version log_entries aspen_log_entries exceptions_sorted tool_entries durations df hosts sessions')
+
+# seconds between refreshes of the snapshot while loading.  Refreshing redoes all the aggregates, so it backs
+# off as the data grows to keep it from taking over the load
+REFRESH_SECONDS = 2.0
+REFRESH_OVERHEAD = 4
+# how often (in lines) the loader checks whether it's time to refresh
+CHECK_LINES = 10000
+
+
+class LoadProgress:
+    def __init__(self):
+        self.files_total = 0
+        self.files_done = 0
+        self.bytes_total = 0
+        self.bytes_parsed = 0
+        self.entries = 0
+        self.current_file = ''
+        self.start_time = None
+        self.end_time = None
+
+    def is_loading(self) -> bool:
+        return self.end_time is None
+
+    def elapsed(self) -> float:
+        if self.start_time is None:
+            return 0.0
+        return (self.end_time or time.time()) - self.start_time
+
+    def entries_per_second(self) -> float:
+        elapsed = self.elapsed()
+        return self.entries / elapsed if elapsed > 0 else 0.0
+
+    def percent(self) -> float:
+        if not self.is_loading():
+            return 100.0    # --from/--to skip most of the bytes
+        return 100.0 * self.bytes_parsed / self.bytes_total if self.bytes_total else 100.0
+
+    def to_dict(self) -> dict:
+        return {
+            'loading': self.is_loading(),
+            'files_total': self.files_total,
+            'files_done': self.files_done,
+            'bytes_total': self.bytes_total,
+            'bytes_parsed': self.bytes_parsed,
+            'percent': round(self.percent(), 1),
+            'entries': self.entries,
+            'entries_per_second': round(self.entries_per_second(), 1),
+            'elapsed': round(self.elapsed(), 1),
+            'current_file': self.current_file,
+        }
+
+
+class LogStore:
+    def __init__(self):
+        self.lock = threading.Lock()
+        # held for the whole of a snapshot build, whether it's the loader's refresh or the first request's
+        self.build_lock = threading.Lock()
+        self.progress = LoadProgress()
+        self.version = 0
+        self.raw_log_entries : List[LogEntry] = []
+        self.raw_aspen_log_entries : List[AspenLogEntry] = []
+        # one per server log file loaded, added up per host in each snapshot
+        self.file_stats : List[HostStats] = []
+        # built the first time it's asked for, since it pulls in numpy and pandas
+        self.current : Optional[LogSnapshot] = None
+
+    def snapshot(self) -> LogSnapshot:
+        with self.lock:
+            if self.current is not None:
+                return self.current
+        with self.build_lock:
+            # the loader may have published one while we waited
+            with self.lock:
+                if self.current is not None:
+                    return self.current
+            snapshot = self.build_snapshot()
+            with self.lock:
+                self.current = snapshot
+            return snapshot
+
+    def add_log_entries(self, entries : List[LogEntry]):
+        self.raw_log_entries.extend(entries)
+        self.progress.entries += len(entries)
+
+    def add_aspen_log_entries(self, entries : List[AspenLogEntry]):
+        self.raw_aspen_log_entries.extend(entries)
+        self.progress.entries += len(entries)
+
+    def add_host_stats(self, stats : HostStats):
+        self.file_stats.append(stats)
+
+    # Rebuilds the aggregates from everything loaded so far and publishes them.  Only the loader thread calls this
+    def refresh(self):
+        with self.build_lock:
+            snapshot = self.build_snapshot()
+            with self.lock:
+                self.current = snapshot
+
+    # only call with build_lock held
+    def build_snapshot(self) -> LogSnapshot:
+        from log_analysis import get_dataframe, get_durations
+        from session_index import SessionIndex
+        with metrics.stage('sort'):
+            log_entries = sorted(self.raw_log_entries, key=lambda x: x.timestamp)
+            aspen_log_entries = sorted(self.raw_aspen_log_entries, key=lambda x: x.timestamp)
+        exceptions_sorted = get_exceptions(log_entries)
+        tool_entries = get_tools_and_mark_log_entries_with_concurrent_jobs(log_entries)
+        durations = get_durations(log_entries)
+        df = get_dataframe(durations)
+        hosts = merge_by_host(list(self.file_stats))
+        sessions = SessionIndex(log_entries)
+        with self.lock:
+            self.version += 1
+            version = self.version
+        return LogSnapshot(version, log_entries, aspen_log_entries, exceptions_sorted, tool_entries, durations, df, hosts, sessions)
+
+
+# Parses one log file in a worker process.  Returns the entries tagged with host, stats for the file (server logs
+# only) and the metrics recorded while parsing it, for the loader to merge into its own.  Workers are reused, so
+# the metrics start over for each file.  detailed is the loader's metrics.detailed (on with --profile)
+def parse_file(kind : str, file_name : str, host : str, start : Optional[str], end : Optional[str],
+               detailed : bool = False) -> Tuple[list, Optional[HostStats], dict]:
+    metrics.clear()
+    metrics.detailed = detailed
+    lines = read_lines(file_name, start, end)
+    if kind == 'aspen':
+        entries = process_aspen_lines(lines)
+        stats = None
+    else:
+        entries = process_lines(lines)
+        stats = HostStats(host)
+        stats.add_all(entries)
+    for entry in entries:
+        entry.host = host
+    return entries, stats, metrics.to_dict()
+
+
+# Parses the log files on a background thread, publishing snapshots to the store as it goes.  hosts maps file
+# names to the server they came from (see hosts.py).  With more than one job and more than one file, files are
+# parsed in parallel in worker processes.  That isn't progressive: a file's entries (and its bytes in the progress)
+# only show up once the whole file is done, and --profile only samples this process, though the workers' stage
+# timings and counters are merged in.  With one job they're parsed a chunk at a time on the loader thread so the
+# pages fill in gradually.
+class LogLoader:
+    def __init__(self, store : LogStore, server_files : List[str], aspen_files : List[str],
+                 start : Optional[str] = None, end : Optional[str] = None, hosts : Optional[Dict[str, str]] = None,
+                 jobs : int = 1):
+        self.store = store
+        self.server_files = server_files
+        self.aspen_files = aspen_files
+        self.start_time = start
+        self.end_time = end
+        self.hosts = hosts or {}
+        self.jobs = jobs
+        self.refresh_interval = REFRESH_SECONDS
+        self.next_refresh = 0.0
+        self.thread = threading.Thread(target=self.run, name='log-loader', daemon=True)
+
+    def start(self):
+        progress = self.store.progress
+        progress.files_total = len(self.server_files) + len(self.aspen_files)
+        progress.bytes_total = sum(os.path.getsize(file_name) for file_name in self.server_files + self.aspen_files)
+        progress.start_time = time.time()
+        self.next_refresh = progress.start_time + self.refresh_interval
+        self.thread.start()
+
+    def host(self, file_name : str) -> str:
+        return self.hosts.get(file_name, DEFAULT_HOST)
+
+    def run(self):
+        progress = self.store.progress
+        try:
+            if self.jobs > 1 and len(self.server_files) + len(self.aspen_files) > 1:
+                self.load_parallel()
+            else:
+                self.load_serial()
+            progress.current_file = ''
+            self.store.refresh()
+        finally:
+            progress.end_time = time.time()
+        print(f'loaded {progress.entries} entries from {progress.files_done} files in {progress.elapsed():.1f}s')
+
+    def load_serial(self):
+        progress = self.store.progress
+        for file_name in self.server_files:
+            progress.current_file = file_name
+            self.load_server_log(file_name)
+            progress.files_done += 1
+        for file_name in self.aspen_files:
+            progress.current_file = file_name
+            aspen_log_entries = process_aspen_lines(self.count_bytes(read_lines(file_name, self.start_time, self.end_time)))
+            self.tag(aspen_log_entries, self.host(file_name))
+            self.store.add_aspen_log_entries(aspen_log_entries)
+            progress.files_done += 1
+            self.maybe_refresh()
+
+    # biggest files first, so one big file doesn't start last and hold everything up
+    def load_parallel(self):
+        progress = self.store.progress
+        files = [('server', file_name) for file_name in self.server_files] + [('aspen', file_name) for file_name in self.aspen_files]
+        files.sort(key=lambda item: -os.path.getsize(item[1]))
+        progress.current_file = f'{len(files)} files in {min(self.jobs, len(files))} processes'
+        sizes = {file_name: os.path.getsize(file_name) for _, file_name in files}
+        # spawn rather than fork, the web server has threads running
+        with ProcessPoolExecutor(self.jobs, mp_context=multiprocessing.get_context('spawn')) as pool:
+            futures = {pool.submit(parse_file, kind, file_name, self.host(file_name), self.start_time, self.end_time,
+                                   metrics.detailed): (kind, file_name)
+                       for kind, file_name in files}
+            for future in as_completed(futures):
+                entries, stats, worker_metrics = future.result()
+                metrics.merge(worker_metrics)
+                kind, file_name = futures[future]
+                if kind == 'aspen':
+                    self.store.add_aspen_log_entries(entries)
+                else:
+                    self.store.add_log_entries(entries)
+                    self.store.add_host_stats(stats)
+                progress.bytes_parsed += sizes[file_name]
+                progress.files_done += 1
+                self.maybe_refresh()
+
+    # parses CHECK_LINES lines at a time, handing entries to the store as it goes
+    def load_server_log(self, file_name : str):
+        host = self.host(file_name)
+        log_entries : List[LogEntry] = []
+        thread_entries = {}
+        published = 0
+        lines = self.count_bytes(read_lines(file_name, self.start_time, self.end_time))
+        while True:
+            with metrics.stage('read'):
+                chunk = list(islice(lines, CHECK_LINES))
+            if not chunk:
+                break
+            process_lines(chunk, log_entries, thread_entries)
+            if time.time() >= self.next_refresh:
+                self.tag(log_entries[published:], host)
+                self.store.add_log_entries(log_entries[published:])
+                published = len(log_entries)
+                self.maybe_refresh()
+        self.tag(log_entries[published:], host)
+        self.store.add_log_entries(log_entries[published:])
+        stats = HostStats(host)
+        stats.add_all(log_entries)
+        self.store.add_host_stats(stats)
+
+    def tag(self, entries : list, host : str):
+        for entry in entries:
+            entry.host = host
+
+    def count_bytes(self, lines):
+        progress = self.store.progress
+        for line_number, line in lines:
+            progress.bytes_parsed += len(line)
+            yield line_number, line
+
+    def maybe_refresh(self):
+        now = time.time()
+        if now < self.next_refresh:
+            return
+        self.store.refresh()
+        took = time.time() - now
+        self.refresh_interval = max(REFRESH_SECONDS, REFRESH_OVERHEAD * took)
+        self.next_refresh = time.time() + self.refresh_interval
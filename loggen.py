@@ -0,0 +1,233 @@
+import argparse
+from datetime import datetime, timedelta
+import json
+import random
+import re
+from typing import TextIO
+
+# Generates realistic looking logs for benchmarks - wildfly server.log (requests/responses, exceptions with stack
+# traces and Caused by chains, TOOL START/FINISH), AspenLog and perfmon4j.  The same seed and size always give the
+# same file.
+
+START_TIME = datetime(2023, 1, 21, 3, 0, 0)
+
+TENANTS = ['ma-somerset', 'ma-lowell', 'nh-concord', 'ri-warwick', 'ct-hartford', 'vt-burlington']
+PATHS = ['/aspen/home.do', '/aspen/portalStudentDetail.do', '/aspen/gradebookScoreEntry.do', '/aspen/rest/users/current',
+         '/aspen/listCatalog.do', '/aspen/attendanceDaily.do', '/aspen/reportRun.do', '/aspen/logon.do',
+         '/aspen/contextList.do', '/aspen/rest/assignments/{oid}/submissions', '/aspen/studentSchedule.do',
+         '/aspen/banner/{oid}', '/aspen/rest/calendar/{oid}/events', '/aspen/toolResult.do']
+METHODS = ['GET'] * 6 + ['POST'] * 3 + ['HEAD']
+SOURCES = ['com.follett.fsc.core.k12.web.AppGlobals', 'com.x2dev.sis.web.SisSessionFilter', 'org.hibernate.SQL',
+           'com.follett.fsc.core.k12.tools.ToolJob', 'io.undertow.request']
+EXCEPTIONS = ['java.lang.NullPointerException', 'java.lang.IllegalStateException: Session already invalidated',
+              'org.hibernate.LazyInitializationException: could not initialize proxy - no Session',
+              'java.sql.SQLTransientConnectionException: Connection is not available, request timed out after 30000ms',
+              'com.follett.fsc.core.k12.business.ValidationException: Record {guid} failed validation',
+              'java.io.IOException: Broken pipe']
+CAUSES = ['java.sql.SQLException: Lock wait timeout exceeded; try restarting transaction',
+          'java.net.SocketTimeoutException: Read timed out',
+          'org.hibernate.exception.JDBCConnectionException: could not execute query',
+          'java.lang.OutOfMemoryError: GC overhead limit exceeded']
+FRAMES = ['com.follett.fsc.core.k12.business.BeanManager.save', 'com.x2dev.sis.model.business.GradesManager.calculate',
+          'org.hibernate.internal.SessionImpl.list', 'io.undertow.servlet.handlers.ServletHandler.handleRequest',
+          'com.follett.fsc.core.k12.web.ActionServlet.process', 'java.base/java.lang.Thread.run']
+TOOLS = ['Student Schedule Report', 'Attendance Export', 'GPA Calculation', 'State Reporting Export', 'Grade Posting']
+LOCATIONS = ['REMOTE', 'REMOTE', 'LOCAL_DELIBERATE', 'LOCAL_UNSERIALIZABLE']
+ASPEN_LOGTYPES = ['TOOL', 'SECURITY', 'SYSTEM', 'USER']
+ASPEN_IDS = ['TLM-00012', 'SEC-00401', 'SYS-00007', 'USR-00110']
+PERFMON_COUNTERS = ['Max Active Threads', 'Throughput', 'Average Duration', 'Median Duration', '> 500 ms', '> 1 second',
+                    '> 2 seconds', 'Standard Deviation', 'Max Duration', 'Min Duration', 'Total Hits', 'Total Completions']
+PERFMON_CATEGORIES = ['WebRequest', 'WebRequest.aspen', 'SQL', 'ToolJob']
+
+size_pattern = re.compile(r'^(?P<number>[0-9.]+)\s*(?P<unit>[KMG]?B?)$', re.IGNORECASE)
+
+
+# '10MB', '1.5GB', '500KB' or plain bytes
+def parse_size(text : str) -> int:
+    match = size_pattern.match(text.strip())
+    if not match:
+        raise ValueError(f'bad size {text}')
+    unit = match.group('unit').upper().rstrip('B')
+    return int(float(match.group('number')) * {'': 1, 'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3}[unit])
+
+
+class LogGenerator:
+    def __init__(self, seed : int):
+        self.random = random.Random(seed)
+        self.time = START_TIME
+        self.lines = 0
+
+    def tick(self, max_ms : int = 40):
+        self.time += timedelta(milliseconds=self.random.randint(0, max_ms))
+
+    def wildfly_timestamp(self) -> str:
+        return self.time.strftime('%Y-%m-%d %H:%M:%S,') + f'{self.time.microsecond // 1000:03d}'
+
+    def oid(self) -> str:
+        letters = 'abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ'
+        return ''.join(self.random.choice(letters) for _ in range(3)) + ''.join(self.random.choice(letters + '0123456789') for _ in range(11))
+
+    def guid(self) -> str:
+        return '-'.join(''.join(self.random.choice('0123456789abcdef') for _ in range(n)) for n in (8, 4, 4, 4, 12))
+
+    def duration(self) -> int:
+        # mostly quick, with a long tail
+        return int(self.random.lognormvariate(4.5, 1.3))
+
+    def write(self, out : TextIO, line : str) -> int:
+        out.write(line)
+        out.write('\n')
+        self.lines += 1
+        return len(line) + 1
+
+
+class WildflyGenerator(LogGenerator):
+    def __init__(self, seed : int):
+        super().__init__(seed)
+        self.sessions = [self.session_id() for _ in range(200)]
+        self.running_tools = []
+
+    def session_id(self) -> str:
+        return ''.join(self.random.choice('0123456789ABCDEF') for _ in range(32)) + f'.app{self.random.randint(10, 99)}'
+
+    def thread(self) -> str:
+        return f'default task-{self.random.randint(1, 64)}'
+
+    def entry(self, level : str, source : str, thread : str, message : str) -> str:
+        return f'{self.wildfly_timestamp()} {level:<5} [{source}] ({thread}) {message}'
+
+    def path(self) -> str:
+        path = self.random.choice(PATHS).replace('{oid}', self.oid())
+        if self.random.random() < 0.3:
+            path += f'?deploymentId=x2sis&_={self.random.randint(1000000, 9999999)}'
+        return path
+
+    def request(self, out : TextIO) -> int:
+        thread = self.thread()
+        tenant = self.random.choice(TENANTS)
+        ipaddr = f'10.{self.random.randint(0, 255)}.{self.random.randint(0, 255)}.{self.random.randint(1, 254)}'
+        method = self.random.choice(METHODS)
+        path = self.path()
+        session = self.random.choice(self.sessions)
+        code = self.random.choices(['200', '302', '404', '500'], [90, 6, 3, 1])[0]
+        size = self.write(out, self.entry('INFO', 'io.undertow.request', thread, f'{tenant}\t---\t{ipaddr}\t---\t{method}\t{path}\t{session}'))
+        self.tick()
+        size += self.write(out, self.entry('INFO', 'io.undertow.request', thread, f'{tenant}\t{self.duration()}ms\t{ipaddr}\t{code}\t{method}\t{path}\t{session}'))
+        return size
+
+    def exception(self, out : TextIO) -> int:
+        thread = self.thread()
+        message = self.random.choice(EXCEPTIONS).replace('{guid}', self.guid())
+        size = self.write(out, self.entry('ERROR', self.random.choice(SOURCES), thread, message))
+        for _ in range(self.random.randint(3, 12)):
+            size += self.write(out, f'\tat {self.random.choice(FRAMES)}({self.random.choice(["Unknown Source", "Native Method"])})')
+        for _ in range(self.random.randint(0, 2)):
+            size += self.write(out, f'Caused by: {self.random.choice(CAUSES)}')
+            for _ in range(self.random.randint(2, 6)):
+                size += self.write(out, f'\tat {self.random.choice(FRAMES)}(Unknown Source)')
+            size += self.write(out, f'\t... {self.random.randint(10, 80)} more')
+        # wildfly sometimes logs more of the trace as separate entries on the same thread
+        if self.random.random() < 0.3:
+            size += self.write(out, self.entry('ERROR', 'stderr', thread, f'\tat {self.random.choice(FRAMES)}(Unknown Source)'))
+        return size
+
+    def tool(self, out : TextIO) -> int:
+        if self.running_tools and self.random.random() < 0.5:
+            data = self.running_tools.pop(self.random.randrange(len(self.running_tools)))
+            data['duration'] = self.random.randint(100, 600000)
+            kind = 'FINISH'
+        else:
+            data = {'deploymentId': 'x2sis', 'toolId': f'RPT{self.random.randint(1000, 9999)}', 'toolName': self.random.choice(TOOLS),
+                    'location': self.random.choice(LOCATIONS), 'duration': 0,
+                    'parameters': {'schoolOid': self.oid(), 'format': self.random.choice(['pdf', 'csv', 'html'])}}
+            self.running_tools.append(dict(data))
+            kind = 'START'
+        return self.write(out, self.entry('INFO', 'com.follett.fsc.core.k12.tools.ToolJob', f'ToolJob-{self.random.randint(1, 8)}', f'TOOL {kind}: {json.dumps(data)}'))
+
+    def plain(self, out : TextIO) -> int:
+        return self.write(out, self.entry(self.random.choice(['INFO', 'INFO', 'WARN', 'DEBUG']), self.random.choice(SOURCES), self.thread(),
+                                          f'Processed {self.random.randint(1, 5000)} records for {self.random.choice(TENANTS)}'))
+
+    def generate(self, out : TextIO, size : int):
+        written = 0
+        while written < size:
+            kind = self.random.random()
+            if kind < 0.80:
+                written += self.request(out)
+            elif kind < 0.86:
+                written += self.exception(out)
+            elif kind < 0.90:
+                written += self.tool(out)
+            else:
+                written += self.plain(out)
+            self.tick()
+
+
+class AspenGenerator(LogGenerator):
+    def generate(self, out : TextIO, size : int):
+        written = 0
+        while written < size:
+            timestamp = self.time.strftime('%Y-%m-%d %H:%M:%S') + ' -0500'
+            logtype = self.random.choice(ASPEN_LOGTYPES)
+            if self.random.random() < 0.02:
+                message = f'TLM-00099: Abort Tool Job {self.random.choice(TOOLS)} after {self.random.randint(60, 3600)}s'
+            elif self.random.random() < 0.8:
+                message = f'{self.random.choice(ASPEN_IDS)}: {logtype.lower()} event for {self.random.choice(TENANTS)} user {self.random.randint(1000, 99999)}'
+            else:
+                message = f'Unstructured message about {self.random.choice(PATHS)}'
+            level = self.random.choice(['INFO', 'INFO', 'INFO', 'WARNING', 'SEVERE'])
+            written += self.write(out, f'{timestamp} {level}: [app{self.random.randint(10, 99)}] [{logtype}] {message}')
+            if level == 'SEVERE':
+                for _ in range(self.random.randint(1, 5)):
+                    written += self.write(out, f'\tat {self.random.choice(FRAMES)}(Unknown Source)')
+            self.tick(500)
+
+
+class PerfmonGenerator(LogGenerator):
+    def generate(self, out : TextIO, size : int):
+        written = 0
+        while written < size:
+            sample_start = self.time - timedelta(minutes=10)
+            for category in PERFMON_CATEGORIES:
+                written += self.write(out, f'{self.wildfly_timestamp()} INFO  [org.perfmon4j.TextAppender] (PerfMon.utilityTimer) ')
+                written += self.write(out, '*' * 80)
+                written += self.write(out, category)
+                written += self.write(out, f'{sample_start.strftime("%H:%M:%S")}:{self.random.randint(0, 999):03d} -> {self.time.strftime("%H:%M:%S")}:{self.random.randint(0, 999):03d}')
+                for counter in PERFMON_COUNTERS:
+                    value = f'{self.random.uniform(0, 5000):.2f}'
+                    extra = f' ({self.time.strftime("%Y-%m-%d %H:%M:%S")}:{self.random.randint(0, 999):03d})' if counter.startswith('M') else ''
+                    written += self.write(out, f' {counter}{"." * max(1, 20 - len(counter))} {value}{extra}')
+                written += self.write(out, '*' * 80)
+                self.tick(50)
+            self.time += timedelta(minutes=10)
+
+
+GENERATORS = {
+    'server': (WildflyGenerator, 'server.log'),
+    'aspen': (AspenGenerator, 'AspenLog.log'),
+    'perfmon': (PerfmonGenerator, 'perfmon4j.log'),
+}
+
+
+# Writes a log of the given kind, returns the number of lines written
+def generate(kind : str, file_name : str, size : int, seed : int = 1) -> int:
+    generator = GENERATORS[kind][0](seed)
+    with open(file_name, 'w', newline='\n') as out:
+        generator.generate(out, size)
+    return generator.lines
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Generates synthetic wildfly, Aspen and perfmon4j logs')
+    parser.add_argument('kind', choices=sorted(GENERATORS.keys()), help='Kind of log to generate')
+    parser.add_argument('filename', type=str, help='Output file')
+    parser.add_argument('--size', action='store', default='10MB', help='Approximate size, e.g. 500KB, 10MB, 2GB (default 10MB)')
+    parser.add_argument('--seed', action='store', type=int, default=1, help='Random seed (default 1)')
+    args = parser.parse_args()
+
+    lines = generate(args.kind, args.filename, parse_size(args.size), args.seed)
+    print(f'wrote {lines:,} lines to {args.filename}')
+
+
+if __name__ == "__main__":
+    main()
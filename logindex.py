@@ -0,0 +1,209 @@
+import argparse
+from bisect import bisect_left
+import hashlib
+from io import TextIOWrapper
+import os
+import re
+from typing import Iterator, List, Optional, Tuple
+from instrument import metrics, add_profile_arguments, start_profile, finish_profile
+
+# Sparse timestamp index for log files.  Every INTERVAL bytes we remember the byte offset, line number and
+# timestamp of the next line that starts a log entry.  The index is kept in a sidecar file next to the log
+# (server.log -> server.log.tsidx) so it's only built once, and is extended when the log has been appended to.
+# With it we can seek straight to the part of the file that covers a --from/--to time window.
+#
+# A rotated log can end up bigger than the one that was indexed, so size alone doesn't say the index still fits.
+# The header keeps a hash of the start of the file, and the last checkpoint is checked against the file too.
+
+INDEX_SUFFIX = '.tsidx'
+INDEX_VERSION = 2
+DEFAULT_INTERVAL = 64 * 1024
+# bytes at the start of the log hashed for the fingerprint (fewer if the log was shorter when it was indexed)
+FINGERPRINT_BYTES = 4096
+
+timestamp_pattern = re.compile(r'^(?P<timestamp>\d+-\d+-\d+ \d+:\d+:\d+)')
+#                                            ^- date and time to the second, at the beginning of line.  Matches wildfly,
+#                                               perfmon4j and aspen logs.  Timestamps are compared as strings, like
+#                                               everywhere else in here, so they need to be zero padded
+binary_timestamp_pattern = re.compile(timestamp_pattern.pattern.encode('ascii'))
+
+
+class LogIndex:
+    def __init__(self, file_name : str, interval : int = DEFAULT_INTERVAL):
+        self.file_name = file_name
+        self.interval = interval
+        self.offsets : List[int] = []
+        self.line_numbers : List[int] = []
+        self.timestamps : List[str] = []
+        self.scanned_offset = 0     # byte offset just past the last complete line we've looked at
+        self.scanned_lines = 0      # number of lines before scanned_offset
+        self.fingerprint_length = 0
+        self.fingerprint = ''
+
+    def index_file_name(self) -> str:
+        return self.file_name + INDEX_SUFFIX
+
+    # Loads the sidecar index, throws it away if it doesn't belong to the log any more (rotated, truncated), and
+    # scans whatever has been appended since it was written.
+    def update(self):
+        size = os.path.getsize(self.file_name)
+        changed = not self.load() or self.scanned_offset > size or not self.matches_file()
+        if changed:
+            self.clear()
+        if self.scanned_offset < size:
+            self.scan()
+            changed = True
+        if changed:
+            self.save()
+
+    def clear(self):
+        self.offsets = []
+        self.line_numbers = []
+        self.timestamps = []
+        self.scanned_offset = 0
+        self.scanned_lines = 0
+        self.fingerprint_length = 0
+        self.fingerprint = ''
+
+    # hash of the first length bytes of the log
+    def file_fingerprint(self, length : int) -> str:
+        with open(self.file_name, 'rb') as open_file:
+            return hashlib.sha1(open_file.read(length)).hexdigest()
+
+    # Whether the loaded index is for the file as it is now: same first bytes, and the last checkpoint is still a
+    # line with that timestamp
+    def matches_file(self) -> bool:
+        try:
+            if self.file_fingerprint(self.fingerprint_length) != self.fingerprint:
+                return False
+            if self.offsets:
+                with open(self.file_name, 'rb') as open_file:
+                    open_file.seek(self.offsets[-1])
+                    if not open_file.readline().startswith(self.timestamps[-1].encode('ascii')):
+                        return False
+            return True
+        except OSError:
+            return False
+
+    def load(self) -> bool:
+        try:
+            with open(self.index_file_name()) as index_file:
+                header = index_file.readline().split()
+                if len(header) != 6 or header[0] != f'v{INDEX_VERSION}' or int(header[1]) != self.interval:
+                    return False
+                self.clear()
+                self.scanned_offset = int(header[2])
+                self.scanned_lines = int(header[3])
+                self.fingerprint_length = int(header[4])
+                self.fingerprint = header[5]
+                for line in index_file:
+                    offset, line_number, timestamp = line.rstrip('\n').split('\t')
+                    self.offsets.append(int(offset))
+                    self.line_numbers.append(int(line_number))
+                    self.timestamps.append(timestamp)
+            return True
+        except (OSError, ValueError):
+            return False
+
+    def save(self):
+        try:
+            with open(self.index_file_name(), 'w') as index_file:
+                index_file.write(f'v{INDEX_VERSION} {self.interval} {self.scanned_offset} {self.scanned_lines} '
+                                 f'{self.fingerprint_length} {self.fingerprint}\n')
+                for offset, line_number, timestamp in zip(self.offsets, self.line_numbers, self.timestamps):
+                    index_file.write(f'{offset}\t{line_number}\t{timestamp}\n')
+        except OSError:
+            pass    # read only directory, we just don't get to keep the index
+
+    # Reads from where the last scan stopped.  Only complete lines are indexed, so a line that's still being
+    # written will be picked up next time.
+    def scan(self):
+        offset = self.scanned_offset
+        line_number = self.scanned_lines
+        next_checkpoint = self.offsets[-1] + self.interval if self.offsets else 0
+        last_timestamp = self.timestamps[-1] if self.timestamps else ''
+        with open(self.file_name, 'rb') as open_file:
+            open_file.seek(offset)
+            for line in open_file:
+                if not line.endswith(b'\n'):
+                    break
+                if offset >= next_checkpoint:
+                    match = binary_timestamp_pattern.match(line)
+                    # the index needs to be in order for bisect.  Clocks going backwards just cost a checkpoint
+                    if match:
+                        timestamp = match.group('timestamp').decode('ascii')
+                        if timestamp >= last_timestamp:
+                            self.offsets.append(offset)
+                            self.line_numbers.append(line_number + 1)
+                            self.timestamps.append(timestamp)
+                            last_timestamp = timestamp
+                            next_checkpoint = offset + self.interval
+                offset += len(line)
+                line_number += 1
+        self.scanned_offset = offset
+        self.scanned_lines = line_number
+        if not self.fingerprint or self.fingerprint_length < min(offset, FINGERPRINT_BYTES):
+            self.fingerprint_length = min(offset, FINGERPRINT_BYTES)
+            self.fingerprint = self.file_fingerprint(self.fingerprint_length)
+
+    # Finds where to start reading to see everything at or after start.  Returns (byte offset, line number).  The
+    # checkpoints only go to the second, so a start with fractions of a second is looked up by its second; read_lines
+    # skips the rest
+    def seek(self, start : Optional[str]) -> Tuple[int, int]:
+        if not start:
+            return 0, 1
+        position = bisect_left(self.timestamps, start[:19]) - 1
+        if position < 0:
+            return 0, 1
+        return self.offsets[position], self.line_numbers[position]
+
+
+def get_index(file_name : str) -> LogIndex:
+    index = LogIndex(file_name)
+    with metrics.stage('index'):
+        index.update()
+    return index
+
+
+# Yields (line number, line) for the lines in file_name that fall in the start/end window.  start and end are
+# inclusive and can be given to any precision, e.g. --to "2023-01-21 03:05" includes everything up to 03:05:59.999,
+# and --from "2023-01-21 03:20:17,5" starts at 03:20:17,500.  They're compared with the same length prefix of each
+# line, which works because the timestamps are fixed width.  Continuation lines (stack traces and such) go along with the entry they belong to.  With no window, this just
+# reads the file.
+def read_lines(file_name : str, start : Optional[str] = None, end : Optional[str] = None) -> Iterator[Tuple[int, str]]:
+    if not start and not end:
+        with open(file_name) as open_file:
+            yield from enumerate(open_file, 1)
+        return
+
+    offset, first_line_number = get_index(file_name).seek(start) if start else (0, 1)
+    with open(file_name, 'rb') as binary_file:
+        binary_file.seek(offset)
+        open_file = TextIOWrapper(binary_file)
+        started = not start
+        for line_number, line in enumerate(open_file, first_line_number):
+            if timestamp_pattern.match(line):
+                if end and line[:len(end)] > end:
+                    return
+                if not started:
+                    started = line[:len(start)] >= start
+            if started:
+                yield line_number, line
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Builds or updates the timestamp index for log files')
+    parser.add_argument('filenames', type=str, nargs='+', help='Log files to index')
+    add_profile_arguments(parser)
+    args = parser.parse_args()
+    profiler = start_profile(args)
+
+    for file_name in args.filenames:
+        index = get_index(file_name)
+        print(f'{file_name}: {len(index.offsets)} checkpoints, {index.scanned_lines} lines')
+
+    finish_profile(args, profiler)
+
+
+if __name__ == "__main__":
+    main()
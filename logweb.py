@@ -1,32 +1,77 @@
 
-import pandas as pd
 import argparse
 from typing import List
-from flask import render_template, request
+from flask import render_template, request, Response, g
+import time
 import connexion
-from log_analysis import get_dataframe, get_durations
-from glob import glob
+from connexion.resolver import Resolver
+import os
+import threading
+from hosts import find_log_files, files_of_kind, host_by_file, find_outliers
+from log_store import LogStore, LogLoader
+from instrument import metrics, add_profile_arguments, start_profile
 
-from structuredlog import calculate_p95, process, LogEntry, LogType
-from aspenlog import process_aspenlog, AspenLogEntry
-from exception_entry import ExceptionEntry, get_exceptions
-from tool_entry import ToolEntry, get_tools_and_mark_log_entries_with_concurrent_jobs, ToolEntryType, ToolLocationType
+from tool_entry import ToolEntryType, ToolLocationType
 
 # app = Flask(__name__)
 app = connexion.App(__name__, specification_dir="./")
 
-log_entries : List[LogEntry] = []
-aspen_log_entries : List[AspenLogEntry] = []
-exceptions_sorted : List[ExceptionEntry] = []
-tool_entries : List[ToolEntry] = []
-durations : dict = {}
-df = None
+# loaded in the background by LogLoader.  Routes work from store.snapshot(), which fills in as files are parsed
+store = LogStore()
+
+# shows loading progress at the bottom of every page, and a host column when logs from more than one server are loaded
+@app.app.context_processor
+def inject_progress():
+    return {"progress": store.progress, "multi_host": len(hosts_loaded) > 1}
+
+# hosts with log files, set in main
+hosts_loaded = set()
+
+# entries from one host with ?host=, otherwise all of them
+def filter_host(entries : list) -> list:
+    host = request.args.get('host')
+    if not host:
+        return entries
+    return [entry for entry in entries if entry.host == host]
+
+@app.route('/progress')
+def route_progress():
+    return store.progress.to_dict()
+
+# per route latency, reported by /metrics
+@app.app.before_request
+def start_timer():
+    g.request_start = time.perf_counter()
+
+@app.app.after_request
+def record_time(response):
+    if request.url_rule is not None and 'request_start' in g:
+        metrics.add_route_time(request.url_rule.rule, time.perf_counter() - g.request_start)
+    return response
+
+# stage timings, counters and route latency in Prometheus text format, or json with ?format=json.  With --profile
+# the json includes the functions the sampling profiler sees most, and /metrics/profile has the sampled stacks
+@app.route('/metrics')
+def route_metrics():
+    if request.args.get('format') == 'json':
+        return metrics.to_dict() | {'progress': store.progress.to_dict()}
+    return Response(metrics.to_prometheus(), mimetype='text/plain')
+
+@app.route('/metrics/profile')
+def route_metrics_profile():
+    if metrics.profiler is None:
+        return Response('profiling is off, start logweb with --profile\n', status=404, mimetype='text/plain')
+    return Response(metrics.profiler.collapsed(), mimetype='text/plain')
 
 @app.route('/')
 def route_index():
+    from log_analysis import get_p95
+    snapshot = store.snapshot()
+    aspen_log_entries = snapshot.aspen_log_entries
+    exceptions_sorted, tool_entries = snapshot.exceptions_sorted, snapshot.tool_entries
     context = {
         "exception_sum": sum([len(exception.log_entries) for exception in exceptions_sorted]),
-        "p95": calculate_p95(log_entries),
+        "p95": int(get_p95(snapshot.durations)),
         "tools_aborted": sum(1 for aspen_log_entry in aspen_log_entries if 'Abort Tool Job' in aspen_log_entry.message),
         "started_len": sum(1 for tool in tool_entries if tool.type == ToolEntryType.START ),
         "finished_len": sum(1 for tool in tool_entries if tool.type == ToolEntryType.FINISH ),
@@ -35,102 +80,197 @@ def route_index():
         "report_remote": sum(1 for tool in tool_entries if tool.type == ToolEntryType.START and tool.location == ToolLocationType.REMOTE.name ),
     }
 
-    print("abort", context["tools_aborted"])
-
     return render_template("index.html", **context)
 
 @app.route('/exceptions')
 def route_exceptions():
-    global exceptions_sorted
-    return render_template("exceptions.html", exceptions_sorted=exceptions_sorted)
+    return render_template("exceptions.html", exceptions_sorted=store.snapshot().exceptions_sorted)
 
 @app.route('/exception-entry/<entry_index>')
 def route_exception_entry(entry_index):
-    global exceptions_sorted
-    return render_template("exception-entry.html", exception=exceptions_sorted[int(entry_index)])
+    return render_template("exception-entry.html", exception=store.snapshot().exceptions_sorted[int(entry_index)])
 
 @app.route('/thread-logs/<thread_id>')
 def route_thread_logs(thread_id):
-    global exceptions_sorted
-    thread_log_entries = [entry for entry in log_entries if entry.thread == thread_id]
+    thread_log_entries = [entry for entry in filter_host(store.snapshot().log_entries) if entry.thread == thread_id]
     return render_template("log-entries.html", log_entries=thread_log_entries, log_filter_id=thread_id, log_type='Thread')
 
 @app.route('/session-logs/<session_id>')
 def route_session_logs(session_id):
-    global log_entries
-    session_log_entries = [entry for entry in log_entries if (entry.type == LogType.RESPONSE or entry.type == LogType.REQUEST) and entry.sessionid == session_id]
+    session_log_entries = store.snapshot().sessions.entries(session_id)
     return render_template("log-entries.html", log_entries=session_log_entries, log_filter_id=session_id, log_type='Session')
 
+# sessions that spent the most time waiting on the server, or ranked by ?sort= one of session_index.SORT_COLUMNS
+@app.route('/sessions')
+def route_sessions():
+    from session_index import SORT_COLUMNS, DEFAULT_LIMIT
+    sort = request.args.get('sort', 'total')
+    limit = request.args.get('limit', DEFAULT_LIMIT, type=int)
+    tenant = request.args.get('tenant')
+    host = request.args.get('host')
+    index = store.snapshot().sessions
+    sessions = index.slowest(sort, limit, tenant, host)
+    return render_template("sessions.html", sessions=sessions, session_count=len(index), sort=sort, sort_columns=SORT_COLUMNS,
+                           limit=limit, tenant=tenant, host=host)
+
+# one session's calls on a timeline
+@app.route('/sessions/<session_id>')
+def route_session_waterfall(session_id):
+    index = store.snapshot().sessions
+    calls = index.calls(session_id)
+    code = index.find(session_id)
+    summary = index.summary(code) if calls else None
+    span = max((call.offset + call.duration for call in calls), default=0)
+    return render_template("session-waterfall.html", session_id=session_id, calls=calls, summary=summary, span=max(span, 1))
+
 @app.route('/logs')
 def route_logs():
-    global log_entries
-    return render_template("log-entries.html", log_entries=log_entries, log_filter_id='', log_type='Logs')
+    return render_template("log-entries.html", log_entries=filter_host(store.snapshot().log_entries), log_filter_id=request.args.get('host', ''), log_type='Logs')
 
 @app.route('/aspenlogs')
 def route_aspen_logs():
-    global aspen_log_entries
-    print(len(aspen_log_entries))
+    aspen_log_entries = filter_host(store.snapshot().aspen_log_entries)
     return render_template("aspen-log-entries.html", log_entries=aspen_log_entries, log_filter_id='', log_type='Aspen Logs')
 
 @app.route('/tools')
 def route_tools():
+    tool_entries = store.snapshot().tool_entries
     started_len = sum(1 for tool in tool_entries if tool.type == ToolEntryType.START )
     finished_len = sum(1 for tool in tool_entries if tool.type == ToolEntryType.FINISH )
     return render_template("tool-entries.html", tool_entries=tool_entries, started_len=started_len, finished_len=finished_len )
 
-# makes a link to requests path, filtered to paths that match val
-def make_requests_link(val):
-    print(f'make_requests_link <{val}>',type(val))
-    return f'<a href="/requests{val}">{val}</a>'
-
-def make_clickable(val, current_sort, descending):
-    if current_sort == val and not descending:
-        return '<a href="/performance?sort=' + val + '&descending=True">' + val + '▲</a>'
-    elif current_sort == val:
-        return '<a href="/performance?sort=' + val + '">' + val + '▼</a>'
-    else:
-        return '<a href="/performance?sort=' + val + '">' + val + '</a>'
-
+# P95, error and exception rates and tool concurrency for each server side by side, to spot the odd one out
+@app.route('/hosts')
+def route_hosts():
+    hosts = store.snapshot().hosts
+    return render_template("hosts.html", hosts=hosts.values(), outliers=find_outliers(hosts))
+
+# rendered performance tables for the current snapshot's data frame, made once per snapshot version under the lock
+# (performance_table and log_query need numpy and pandas, so they're imported when first used)
+performance_table = None
+performance_table_version = None
+performance_table_lock = threading.Lock()
+
+def get_performance_table():
+    from performance_table import PerformanceTable
+    global performance_table, performance_table_version
+    snapshot = store.snapshot()
+    with performance_table_lock:
+        # a request still holding an older snapshot gets the newer table rather than replacing it
+        if performance_table is None or performance_table_version < snapshot.version:
+            performance_table = PerformanceTable(snapshot.df)
+            performance_table_version = snapshot.version
+        return performance_table
 
 @app.route('/performance')
 def route_performance():
-    print(df.head())
-    print('sort', request.args.get('sort'))
-    #html_table = df.to_html(escape=False)
+    from performance_table import allowed_page_size
+    table = get_performance_table()
 
     sort_param = request.args.get('sort')
     descending_param = request.args.get('descending') == "True"
+    page_size = allowed_page_size(request.args.get('page_size', None, type=int))
+    page = table.clamp_page(request.args.get('page', 0, type=int), page_size)
 
-    make_clickable_with_current = lambda x: make_clickable(x, sort_param, descending_param)
-
-    if sort_param:
-        final_df = df.sort_values(by=[sort_param], ascending=not descending_param)
-    else:
-        final_df = df
-
-    html_table = (final_df.style
-            .format(precision=0, thousands=",") # todo - why is this not working anymore, it was.  might be related to make_requests_link format call 
-            .format_index(make_clickable_with_current, axis="columns")
-            .set_properties(**{'text-align': 'right'}, subset=df.columns[1:])
-            .format({df.columns[0]:make_requests_link}, subset=df.columns[1:])
-            .hide_index()
-            .render())
-    return render_template("performance.html", data=html_table)
+    html_table = table.render(sort_param, descending_param, page, page_size)
+    return render_template("performance.html", data=html_table, page=page, page_count=table.page_count(page_size),
+                           sort=sort_param, descending=descending_param, page_size=page_size)
 
 @app.route('/requests/<path:path>')
 def route_requests(path):
-    print(f'path= <{path}>')
     path = f'/{path}'
-    request_log_entries = [entry for entry in log_entries if (entry.is_request() or entry.is_response()) and entry.get_deidentified_path() == path]
-    for log_entry in request_log_entries[:10]:
-        print(f'entry=<{log_entry.get_deidentified_path()}>')
-    print(len(request_log_entries))
+    request_log_entries = [entry for entry in store.snapshot().log_entries if (entry.is_request() or entry.is_response()) and entry.get_deidentified_path() == path]
     return render_template("log-entries.html", log_entries=request_log_entries, log_filter_id=path, log_type='Path')
 
 
+# anomalies for the current snapshot, keyed by (snapshot version, window, threshold).  Only the latest snapshot's are
+# kept.  Worked out under the lock so concurrent requests share one computation
+anomaly_cache = {}
+anomaly_cache_lock = threading.Lock()
+
+def get_anomalies(window : int, threshold : float) -> list:
+    from anomalies import get_anomalies as find_anomalies
+    global anomaly_cache
+    snapshot = store.snapshot()
+    key = (snapshot.version, window, threshold)
+    with anomaly_cache_lock:
+        anomalies = anomaly_cache.get(key)
+        if anomalies is None:
+            anomaly_cache = {cached: value for cached, value in anomaly_cache.items() if cached[0] == snapshot.version}
+            anomalies = find_anomalies(snapshot.log_entries, snapshot.durations, window, threshold)
+            anomaly_cache[key] = anomalies
+        return anomalies
+
+# time windows where a path's P95 or error rate jumped compared to its recent past, most unusual first
+@app.route('/anomalies')
+def route_anomalies():
+    from anomalies import WINDOW_MINUTES, THRESHOLD
+    window = max(request.args.get('window', WINDOW_MINUTES, type=int), 1)
+    threshold = request.args.get('threshold', THRESHOLD, type=float)
+    kind = request.args.get('kind')
+    limit = request.args.get('limit', 500, type=int)
+    anomalies = [anomaly for anomaly in get_anomalies(window, threshold) if not kind or anomaly.kind == kind]
+    return render_template("anomalies.html", anomalies=anomalies[:limit], total=len(anomalies), window=window, threshold=threshold, kind=kind)
+
+# columnar copy of the current snapshot's log entries for the query api.  Built under the lock so concurrent
+# requests share one build
+query_index = None
+query_index_lock = threading.Lock()
+
+def get_query_index():
+    from log_query import LogQueryIndex
+    global query_index
+    log_entries = store.snapshot().log_entries
+    with query_index_lock:
+        if query_index is None or query_index.log_entries is not log_entries:
+            query_index = LogQueryIndex(log_entries)
+        return query_index
+
+# inverted index over the current snapshot's messages and stack traces, built the first time it's searched.  Built
+# under the lock so searches that come in while it's building wait for it instead of each building their own
+search_index = None
+search_index_lock = threading.Lock()
+
+def get_search_index():
+    from search_index import SearchIndex
+    global search_index
+    snapshot = store.snapshot()
+    with search_index_lock:
+        if search_index is None or search_index.log_entries is not snapshot.log_entries or search_index.aspen_log_entries is not snapshot.aspen_log_entries:
+            search_index = SearchIndex(snapshot.log_entries, snapshot.aspen_log_entries)
+        return search_index
+
+# full text search over Wildfly and Aspen entries.  ?q= takes words, "phrases", prefix*, OR and -word / NOT word
+# (see search_index.py), ?log= server or aspen, ?host=, and ?page= / ?size= page through the hits in time order
+@app.route('/search')
+def route_search():
+    from search_index import SearchError, DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE
+    text = request.args.get('q', '').strip()
+    log = request.args.get('log') or None
+    host = request.args.get('host') or None
+    page = max(request.args.get('page', 1, type=int), 1)
+    size = min(max(request.args.get('size', DEFAULT_PAGE_SIZE, type=int), 1), MAX_PAGE_SIZE)
+    hits, total, error = [], 0, None
+    if text:
+        try:
+            hits, total = get_search_index().page(text, page, size, log, host)
+        except SearchError as e:
+            error = str(e)
+    pages = (total + size - 1) // size
+    return render_template("search.html", q=text, log=log, host=host, page=page, size=size, hits=hits, total=total,
+                           pages=pages, error=error, hosts=sorted(hosts_loaded))
+
+# GET /api/logs, see swagger.yaml
 def api_logs():
-    global log_entries
-    return log_entries
+    from log_query import QueryError, run_query
+    try:
+        lines, next_cursor, matches = run_query(get_query_index(), request.args)
+    except QueryError as e:
+        return {"error": str(e)}, 400, {"Content-Type": "application/json"}
+    headers = {"X-Total-Matches": str(matches)}
+    if next_cursor is not None:
+        headers["X-Next-Cursor"] = str(next_cursor)
+    return Response(lines, mimetype="application/x-ndjson", headers=headers)
 
 def column_format(x):
     print(f'column format <{x}>')
@@ -142,24 +282,27 @@ def main():
     # parser.add_argument('--server', action='store', default='', required=False, help='Wildfly log filename')
     # parser.add_argument('--perfmon', action='store', default='', required=False, help='Perfmon4j log filename')
     # parser.add_argument('--aspen', action='store', default='', required=False, help='Aspen log filename')
-    parser.add_argument('--data', action='store', default='.', required=False, help='Directory containing log files')
+    parser.add_argument('--data', action='store', default='.', required=False, help='Directory containing log files, or a subdirectory of log files per server (see grablog --by-host)')
+    parser.add_argument('--jobs', action='store', type=int, required=False, help='Processes to parse log files with.  With more than one, files are parsed in parallel but each only shows up once it is done (default: number of CPUs when --data has more than one server, otherwise 1 so the pages fill in as it goes)')
+    parser.add_argument('--from', dest='start', action='store', required=False, help='Only read entries at or after this time, e.g. "2023-01-21 03:00"')
+    parser.add_argument('--to', dest='end', action='store', required=False, help='Only read entries up to this time, inclusive, e.g. "2023-01-21 03:05"')
+    add_profile_arguments(parser)
     args = parser.parse_args()
     print(args)
-    global log_entries, exceptions_sorted, tool_entries, durations, df, aspen_log_entries
+    start_profile(args)
 
     # print('server: ', glob(f'{args.data}/server.log*'))
     # print('aspen: ', glob('Aspen*.log*', root_dir=args.data))
     # print('perf: ', glob('perfmon4j.log*', root_dir=args.data))
 
-    log_entries = process( glob(f'{args.data}/server.log*'))
-    aspen_log_entries = process_aspenlog( glob(f'{args.data}/Aspen*.log*') )
-    exceptions_sorted = get_exceptions(log_entries)
-    tool_entries = get_tools_and_mark_log_entries_with_concurrent_jobs(log_entries)
-    durations = get_durations(log_entries)
-    df = get_dataframe(durations)
-    print('axes',df.axes)
+    # parsing happens in the background, the pages fill in as it goes
+    log_files = find_log_files(args.data)
+    hosts_loaded.update(log_file.host for log_file in log_files)
+    jobs = args.jobs or (os.cpu_count() if len(hosts_loaded) > 1 else 1)
+    LogLoader(store, files_of_kind(log_files, 'server'), files_of_kind(log_files, 'aspen'), args.start, args.end,
+              host_by_file(log_files), jobs).start()
 
-    # app.add_api("swagger.yaml")
+    app.add_api("swagger.yaml", resolver=Resolver(lambda operation_id: globals()[operation_id]))
     app.run(debug=True, host='0.0.0.0')
 
 if __name__ == '__main__':
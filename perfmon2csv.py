@@ -1,11 +1,12 @@
 import argparse
 from collections import defaultdict
+from datetime import datetime
 from io import TextIOWrapper
 import re
 import sys
-from typing import List
-import pandas as pd 
-from dateutil.parser import parse
+from typing import Iterable, Iterator, List
+from logindex import read_lines
+from instrument import metrics, add_profile_arguments, start_profile, finish_profile
 
 perfmon_logline_pattern = re.compile( '^(?P<log_date>\\d\\d\\d\\d-\\d\\d-\\d\\d) (?P<log_time>\\d\\d:\\d\\d:\\d\\d,\\d+) *\\w+\\s+\\[org.perfmon4j.TextAppender\\] \\(PerfMon.utilityTimer\\)')
 #                                                                                                                                    ^- perfmon logger pattern
@@ -26,6 +27,8 @@ counter_value_pattern = re.compile( '^ (?P<name>.+)\\. (?P<value>[0-9.-]*)(?P<ex
 #                                       ^- everything up to the delimiter is name
 #                                     ^- first column is the space
 
+SAMPLE_TIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+
 class PerfmonEntry:
     def __init__(self, log_date : str, log_time : str):
         self.log_date = log_date
@@ -57,8 +60,8 @@ class PerfmonEntry:
             range_match = sample_range_pattern.match(line)
             if not range_match:
                 raise Exception(f'Unable to parse sample range [{line}]')
-            self.sample_start = parse( f"{self.log_date} {range_match.group('sample_start')}" )
-            self.sample_end = parse( f"{self.log_date} {range_match.group('sample_end')}" )
+            self.sample_start = datetime.strptime( f"{self.log_date} {range_match.group('sample_start')}", SAMPLE_TIME_FORMAT )
+            self.sample_end = datetime.strptime( f"{self.log_date} {range_match.group('sample_end')}", SAMPLE_TIME_FORMAT )
             return False
         if line.startswith('Lifetime'):
             self.lifetime_entries = dict()
@@ -102,24 +105,26 @@ def process_log_line(line : str) -> PerfmonEntry:
 
 
 
+@metrics.timed('perfmon_parse')
 def process_file(open_file: TextIOWrapper) -> List[PerfmonEntry]:
+    return list(iter_entries(open_file))
+
+# Samples one at a time, as each one's closing asterisk line is read
+def iter_entries(lines: Iterable[str]) -> Iterator[PerfmonEntry]:
     perfmon_entry = None
-    perfmon_entries : List[PerfmonEntry] = []
 
-    for line in open_file:
+    for line in lines:
         line = line.rstrip()
         if perfmon_entry:
             if perfmon_entry.process(line):
-                perfmon_entries.append(perfmon_entry)
+                yield perfmon_entry
                 perfmon_entry = None
         else:
             perfmon_entry = process_log_line(line)
 
-    return perfmon_entries
-
-def process_perfmon( file_name : str) -> List[PerfmonEntry]:
-    with open(file_name) as open_file:
-        return process_file(open_file)
+# start and end limit entries to a time window, e.g. '2023-01-21 03:00'.  See logindex
+def process_perfmon( file_name : str, start : str = None, end : str = None) -> List[PerfmonEntry]:
+    return process_file(line for _, line in read_lines(file_name, start, end))
 
 def list_counters(perfmon_entries):
     names = sorted(set(list(map( lambda entry: entry.counter_name, perfmon_entries))))
@@ -155,6 +160,7 @@ def perfmon_to_dataframe(perfmon_entries : List[PerfmonEntry], counters):
     sorted_keys = sorted(df_data.keys())
     sorted_data = [df_data[key] for key in sorted_keys ]
     
+    import pandas as pd     # only needed for csv output, so --list doesn't pay for it
     df = pd.DataFrame(sorted_data, index=sorted_keys, columns=counters)
     return df
 
@@ -163,6 +169,7 @@ def get_dataframe(perfmon_entries : List[PerfmonEntry]):
     for perfmon_entry in perfmon_entries:
         data_lists[perfmon_entry.counter_name].append(perfmon_entry)
     
+    import pandas as pd
     df = pd.DataFrame([i.to_dict() for i in data_lists.values()[0]])
 
     return df
@@ -175,13 +182,19 @@ def main():
     parser.add_argument('-l', '--list', action='store_true', help='Lists perfmon counters' )
     parser.add_argument('--csv', action='store', required=False, help='Counter name to generate CSV')
     parser.add_argument('--output', action='store', default='', required=False, help='Output file name for csv (defaults to stdout)')
+    parser.add_argument('--from', dest='start', action='store', required=False, help='Only read entries at or after this time, e.g. "2023-01-21 03:00"')
+    parser.add_argument('--to', dest='end', action='store', required=False, help='Only read entries up to this time, inclusive, e.g. "2023-01-21 03:05"')
+    add_profile_arguments(parser)
     args = parser.parse_args()
+    profiler = start_profile(args)
 
-    perfmon_entries = process_perfmon(args.filename)
+    perfmon_entries = process_perfmon(args.filename, args.start, args.end)
     if args.list:
         list_counters(perfmon_entries)
     if args.csv:
         print_csv(perfmon_entries,args.csv, args.output)
 
+    finish_profile(args, profiler)
+
 if __name__ == "__main__":
     main()
\ No newline at end of file
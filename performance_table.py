@@ -0,0 +1,99 @@
+import threading
+from typing import Optional
+import numpy as np
+import pandas as pd
+
+# tables bigger than this get split into pages unless a page size is asked for
+MAX_UNPAGED_ROWS = 2000
+DEFAULT_PAGE_SIZE = 500
+# page sizes that can be asked for, anything else is rounded up to one of these (or down to the biggest).  Rendered
+# pages are cached per page size, so this keeps the cache from growing with every size someone types in
+PAGE_SIZES = (100, 250, 500, 1000, 2000, 5000)
+
+
+# one of PAGE_SIZES, or None for no page size given
+def allowed_page_size(page_size : Optional[int]) -> Optional[int]:
+    if not page_size:
+        return None
+    return next((size for size in PAGE_SIZES if size >= page_size), PAGE_SIZES[-1])
+
+
+# makes a link to requests path, filtered to paths that match val
+def make_requests_link(val):
+    return f'<a href="/requests{val}">{val}</a>'
+
+def make_clickable(val, current_sort, descending, page_size):
+    size = f'&page_size={page_size}' if page_size else ''
+    if current_sort == val and not descending:
+        return '<a href="/performance?sort=' + val + '&descending=True' + size + '">' + val + '▲</a>'
+    elif current_sort == val:
+        return '<a href="/performance?sort=' + val + size + '">' + val + '▼</a>'
+    else:
+        return '<a href="/performance?sort=' + val + size + '">' + val + '</a>'
+
+
+# Renders the /performance table.  Sorting uses an argsort per column that's worked out the first time the column
+# is sorted on, and rendered html is kept per (sort, direction, page), so the Styler only runs once for each.
+# Make a new one when the data frame changes.
+class PerformanceTable:
+    def __init__(self, df : pd.DataFrame):
+        self.df = df
+        self.orderings = {}
+        self.rendered = {}
+        self.lock = threading.Lock()
+
+    def ordering(self, column : str, descending : bool) -> np.ndarray:
+        order = self.orderings.get(column)
+        if order is None:
+            order = np.argsort(self.df[column].to_numpy(), kind='stable')
+            self.orderings[column] = order
+        return order[::-1] if descending else order
+
+    def page_count(self, page_size : Optional[int]) -> int:
+        page_size = self.effective_page_size(page_size)
+        if not page_size:
+            return 1
+        return max(1, -(-len(self.df.index) // page_size))
+
+    # page_size of None pages only if the table is big
+    def effective_page_size(self, page_size : Optional[int]) -> Optional[int]:
+        page_size = allowed_page_size(page_size)
+        if page_size:
+            return page_size
+        return DEFAULT_PAGE_SIZE if len(self.df.index) > MAX_UNPAGED_ROWS else None
+
+    # page number (from 0) within the pages there are
+    def clamp_page(self, page : int, page_size : Optional[int]) -> int:
+        return min(max(page, 0), self.page_count(page_size) - 1)
+
+    def render(self, sort : Optional[str], descending : bool, page : int = 0, page_size : Optional[int] = None) -> str:
+        if sort not in self.df.columns:
+            sort = None
+        page = self.clamp_page(page, page_size)
+        page_size = self.effective_page_size(page_size)
+        key = (sort, descending, page, page_size)
+        with self.lock:
+            html = self.rendered.get(key)
+            if html is None:
+                html = self.render_table(sort, descending, page, page_size)
+                self.rendered[key] = html
+        return html
+
+    def render_table(self, sort : Optional[str], descending : bool, page : int, page_size : Optional[int]) -> str:
+        df = self.df
+        if sort:
+            rows = self.ordering(sort, descending)
+        else:
+            rows = np.arange(len(df.index))
+        if page_size:
+            rows = rows[page * page_size:(page + 1) * page_size]
+        final_df = df.iloc[rows]
+
+        make_clickable_with_current = lambda x: make_clickable(x, sort, descending, page_size)
+        return (final_df.style
+                .format(precision=0, thousands=",", subset=df.columns[1:])
+                .format(make_requests_link, subset=df.columns[:1])
+                .format_index(make_clickable_with_current, axis="columns")
+                .set_properties(**{'text-align': 'right'}, subset=df.columns[1:])
+                .hide(axis="index")
+                .to_html())
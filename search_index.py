@@ -0,0 +1,280 @@
+import re
+import threading
+from bisect import bisect_left
+from collections import defaultdict, namedtuple
+from heapq import merge
+from typing import Dict, List, Optional, Tuple, Union
+import numpy as np
+
+from structuredlog import LogEntry
+from aspenlog import AspenLogEntry
+from instrument import metrics
+
+# Full text search over the message and continuation lines (stack traces and the like) of Wildfly and Aspen
+# entries.  Each entry is a document, numbered in timestamp order across both logs.  Text is split into lower case
+# word tokens - runs of letters, digits and _, so java.lang.NullPointerException is java, lang,
+# nullpointerexception - and each token keeps a sorted array of the documents it's in.  A query is a few lookups
+# and intersections of those arrays however many entries there are.  Token positions aren't kept, since they'd
+# be several times the size; a phrase is looked up as all of its tokens, then checked against the text of just
+# those documents.
+#
+#   timeout deadlock          entries with both words
+#   timeout OR deadlock       either word.  OR binds tighter than AND, so  a OR b c  is  (a OR b) and c
+#   "connection reset"        the words next to each other, in that order
+#   nullpointer*              any word starting with nullpointer
+#   -debug, NOT debug         entries without the word (or phrase)
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+# a prefix stops expanding after this many words
+MAX_PREFIX_TERMS = 5000
+# searches remembered per index, so paging through results doesn't redo them
+CACHE_SIZE = 32
+# continuation lines shown with each hit
+MATCHING_LINES = 3
+# entries tokenized at a time
+CHUNK_DOCUMENTS = 10000
+
+# Tokens are what's left between ASCII characters other than letters, digits and _.  Lower casing and translating
+# those to spaces for a chunk of entries at once, then splitting, is far quicker than a regex per entry
+NON_WORD = ''.join(chr(code) for code in range(128) if not (chr(code).isalnum() or chr(code) == '_'))
+# stands between entries in a chunk, as a token of its own.  ASCII, so translate stays on its fast path
+DOCUMENT_SEPARATOR = '\x00'
+TOKEN_TABLE = str.maketrans({character: ' ' for character in NON_WORD if character != DOCUMENT_SEPARATOR})
+NON_WORD_ESCAPED = re.escape(NON_WORD)
+non_word_class = f'[{NON_WORD_ESCAPED}]'
+query_pattern = re.compile(r'(-?)"([^"]*)"|(\S+)')
+
+EMPTY = np.array([], dtype=np.int32)
+
+# kind is 'word', 'prefix' or 'phrase'.  tokens are lower case
+Term = namedtuple('Term', 'kind tokens')
+# include is a list of clauses that all have to match, each a list of terms any of which can match
+Query = namedtuple('Query', 'include exclude')
+# one search result.  lines are the continuation lines that have a search term in them
+Hit = namedtuple('Hit', 'entry log lines')
+
+
+class SearchError(Exception):
+    pass
+
+
+def entry_text(entry : Union[LogEntry, AspenLogEntry]) -> str:
+    if not entry.lines:
+        return entry.message
+    return '\n'.join([entry.message] + entry.lines)
+
+def tokenize(text : str) -> List[str]:
+    return text.lower().translate(TOKEN_TABLE).replace(DOCUMENT_SEPARATOR, ' ').split()
+
+def make_term(text : str) -> Optional[Term]:
+    tokens = tokenize(text)
+    if not tokens:
+        return None
+    if len(tokens) > 1:
+        return Term('phrase', tuple(tokens))
+    if text.endswith('*'):
+        return Term('prefix', tuple(tokens))
+    return Term('word', tuple(tokens))
+
+def parse_query(text : str) -> Query:
+    if text.count('"') % 2:
+        raise SearchError('unbalanced quote')
+    include : List[List[Term]] = []
+    exclude : List[Term] = []
+    negate = False
+    alternative = False
+    for match in query_pattern.finditer(text):
+        minus, phrase, word = match.groups()
+        if word == 'OR':
+            alternative = bool(include) and not negate
+            continue
+        if word == 'NOT':
+            negate = True
+            continue
+        if word == 'AND':
+            continue
+        if word and word.startswith('-') and len(word) > 1:
+            minus, word = '-', word[1:]
+        term = make_term(phrase if phrase is not None else word)
+        if term is None:
+            continue
+        if negate or minus:
+            exclude.append(term)
+        elif alternative:
+            include[-1].append(term)
+        else:
+            include.append([term])
+        negate = False
+        alternative = False
+    if not include and not exclude:
+        raise SearchError('nothing to search for')
+    return Query(include, exclude)
+
+# Matches any of the query's words, prefixes or phrases, for picking out the lines worth showing
+def highlight_pattern(query : Query) -> Optional[re.Pattern]:
+    patterns = [term_pattern(term) for clause in query.include for term in clause]
+    return re.compile('|'.join(patterns), re.IGNORECASE) if patterns else None
+
+def term_pattern(term : Term) -> str:
+    pattern = (non_word_class + '+').join(re.escape(token) for token in term.tokens)
+    return f'(?<![^{NON_WORD_ESCAPED}])' + pattern + ('' if term.kind == 'prefix' else f'(?![^{NON_WORD_ESCAPED}])')
+
+
+# a and b are sorted and unique.  Goes through the shorter one, binary searching the longer
+def intersect(a : np.ndarray, b : np.ndarray) -> np.ndarray:
+    if len(a) > len(b):
+        a, b = b, a
+    if len(a) == 0:
+        return a
+    positions = np.minimum(np.searchsorted(b, a), len(b) - 1)
+    return a[b[positions] == a]
+
+def difference(a : np.ndarray, b : np.ndarray) -> np.ndarray:
+    if len(a) == 0 or len(b) == 0:
+        return a
+    positions = np.minimum(np.searchsorted(b, a), len(b) - 1)
+    return a[b[positions] != a]
+
+
+# Inverted index over a snapshot's entries.  Make one per snapshot; the entries mustn't change underneath it.  Searches
+# come in on request threads, so the cache of recent results is only touched under the lock
+class SearchIndex:
+    @metrics.timed('search_index')
+    def __init__(self, log_entries : List[LogEntry], aspen_log_entries : List[AspenLogEntry]):
+        self.log_entries = log_entries
+        self.aspen_log_entries = aspen_log_entries
+        # both lists are sorted by timestamp already.  Aspen has a UTC offset on the end, so compare up to the second
+        self.documents : List[Union[LogEntry, AspenLogEntry]] = list(merge(log_entries, aspen_log_entries, key=lambda entry: entry.timestamp[:19]))
+
+        # (token, document) pairs, a chunk of documents at a time, without repeats
+        token_ids : Dict[str, int] = defaultdict(lambda: len(token_ids))
+        separator = token_ids[DOCUMENT_SEPARATOR]
+        pair_tokens = []
+        pair_documents = []
+        for chunk_start in range(0, len(self.documents), CHUNK_DOCUMENTS):
+            chunk = self.documents[chunk_start:chunk_start + CHUNK_DOCUMENTS]
+            texts = [entry_text(entry) for entry in chunk]
+            text = f' {DOCUMENT_SEPARATOR} '.join(texts)
+            if text.count(DOCUMENT_SEPARATOR) != len(chunk) - 1:
+                text = f' {DOCUMENT_SEPARATOR} '.join(text.replace(DOCUMENT_SEPARATOR, ' ') for text in texts)
+            tokens = text.lower().translate(TOKEN_TABLE).split()
+            ids = np.fromiter(map(token_ids.__getitem__, tokens), dtype=np.int64, count=len(tokens))
+            is_separator = ids == separator
+            documents = np.cumsum(is_separator)[~is_separator]
+            # sort and drop repeats, which for ints is quicker than np.unique
+            pairs = np.sort(ids[~is_separator] * CHUNK_DOCUMENTS + documents)
+            pairs = pairs[np.concatenate(([True], pairs[1:] != pairs[:-1]))]
+            pair_tokens.append((pairs // CHUNK_DOCUMENTS).astype(np.int32))
+            pair_documents.append((pairs % CHUNK_DOCUMENTS + chunk_start).astype(np.int32))
+        self.token_ids = dict(token_ids)
+        del self.token_ids[DOCUMENT_SEPARATOR]
+        # every token's documents, one after another.  Sorting by token keeps each token's documents in order, since
+        # chunks are in document order and each chunk's pairs were sorted
+        pair_tokens = np.concatenate(pair_tokens) if pair_tokens else EMPTY
+        order = np.argsort(pair_tokens, kind='stable')
+        self.token_documents = np.concatenate(pair_documents)[order] if pair_documents else EMPTY
+        self.offsets = np.concatenate(([0], np.cumsum(np.bincount(pair_tokens, minlength=len(token_ids))))).astype(np.int64)
+        self.vocabulary : Optional[List[str]] = None
+
+        self.host_codes : Dict[str, int] = {}
+        self.hosts = np.array([self.host_codes.setdefault(entry.host, len(self.host_codes)) for entry in self.documents], dtype=np.int16)
+        self.aspen = np.array([isinstance(entry, AspenLogEntry) for entry in self.documents], dtype=bool)
+        self.cache : Dict[tuple, Tuple[Query, np.ndarray]] = {}
+        self.lock = threading.Lock()
+        metrics.count('search_tokens', len(self.token_ids))
+
+    def __len__(self):
+        return len(self.documents)
+
+    # documents with the token, in order
+    def postings(self, token : str) -> np.ndarray:
+        token_id = self.token_ids.get(token)
+        if token_id is None:
+            return EMPTY
+        return self.token_documents[self.offsets[token_id]:self.offsets[token_id + 1]]
+
+    # Documents (sorted) matching the query, optionally only from one log ('server' or 'aspen') or host
+    def search(self, text : str, log : Optional[str] = None, host : Optional[str] = None) -> Tuple[Query, np.ndarray]:
+        key = (text, log, host)
+        with self.lock:
+            cached = self.cache.get(key)
+        if cached is not None:
+            return cached
+        query = parse_query(text)
+        with metrics.stage('search'):
+            documents = self.restrict(log, host)
+            # cheapest first, so the phrases have as few documents as possible left to check
+            for clause in sorted(query.include, key=self.cost):
+                found = None
+                for term in clause:
+                    term_documents = self.term_documents(term, documents)
+                    found = term_documents if found is None else np.union1d(found, term_documents)
+                documents = found if documents is None else intersect(documents, found)
+            if documents is None:
+                documents = np.arange(len(self.documents), dtype=np.int32)
+            for term in query.exclude:
+                documents = difference(documents, self.term_documents(term, documents))
+        with self.lock:
+            if key not in self.cache and len(self.cache) >= CACHE_SIZE:
+                del self.cache[next(iter(self.cache))]
+            self.cache[key] = (query, documents)
+        return query, documents
+
+    # one page of hits (page counts from 1) and the total number of them
+    def page(self, text : str, page : int = 1, page_size : int = DEFAULT_PAGE_SIZE, log : Optional[str] = None,
+             host : Optional[str] = None) -> Tuple[List[Hit], int]:
+        query, documents = self.search(text, log, host)
+        pattern = highlight_pattern(query)
+        start = (page - 1) * page_size
+        hits = []
+        for document in documents[start:start + page_size]:
+            entry = self.documents[document]
+            lines = [line for line in entry.lines if pattern and pattern.search(line)][:MATCHING_LINES]
+            hits.append(Hit(entry, 'aspen' if self.aspen[document] else 'server', lines))
+        return hits, len(documents)
+
+    # documents a filter leaves, or None for all of them
+    def restrict(self, log : Optional[str], host : Optional[str]) -> Optional[np.ndarray]:
+        if not log and not host:
+            return None
+        mask = np.ones(len(self.documents), dtype=bool)
+        if log:
+            mask &= self.aspen if log == 'aspen' else ~self.aspen
+        if host:
+            mask &= self.hosts == self.host_codes.get(host, -1)
+        return np.flatnonzero(mask).astype(np.int32)
+
+    # rough number of documents a clause has to look at
+    def cost(self, clause : List[Term]) -> int:
+        return sum(len(self.postings(term.tokens[0])) + (len(self.documents) if term.kind != 'word' else 0) for term in clause)
+
+    # documents with the term, from within (if given).  Phrases are only checked against the text of documents
+    # that have all their words
+    def term_documents(self, term : Term, within : Optional[np.ndarray] = None) -> np.ndarray:
+        if term.kind == 'prefix':
+            documents = self.prefix_documents(term.tokens[0])
+        else:
+            documents = None
+            for token in sorted(term.tokens, key=lambda token: len(self.postings(token))):
+                token_documents = self.postings(token)
+                documents = token_documents if documents is None else intersect(documents, token_documents)
+        if within is not None:
+            documents = intersect(documents, within)
+        if term.kind == 'phrase' and len(documents):
+            pattern = re.compile(term_pattern(term), re.IGNORECASE)
+            documents = documents[np.array([bool(pattern.search(entry_text(self.documents[document]))) for document in documents], dtype=bool)]
+        return documents
+
+    # sorted the first time a prefix is searched for
+    def prefix_documents(self, prefix : str) -> np.ndarray:
+        if self.vocabulary is None:
+            self.vocabulary = sorted(self.token_ids)
+        arrays = []
+        position = bisect_left(self.vocabulary, prefix)
+        while position < len(self.vocabulary) and self.vocabulary[position].startswith(prefix) and len(arrays) < MAX_PREFIX_TERMS:
+            arrays.append(self.postings(self.vocabulary[position]))
+            position += 1
+        if not arrays:
+            return EMPTY
+        return np.unique(np.concatenate(arrays))
@@ -0,0 +1,185 @@
+import re
+from collections import namedtuple
+from typing import Dict, List, Optional
+import numpy as np
+
+from structuredlog import LogEntry, LogType
+from instrument import metrics
+
+# User sessions put back together from the request/response entries.  Each response is paired with the request
+# logged before it on the same thread, giving one call per pair with its start, end and server time.  Calls are
+# kept as numpy arrays sorted by (session, start), so a session's calls are one slice and the per session numbers
+# for every session come out of a single reduceat over the arrays.
+
+# what the slowest sessions can be ranked by
+SORT_COLUMNS = ['total', 'longest', 'span', 'gap', 'calls', 'errors']
+DEFAULT_LIMIT = 100
+
+# wildfly adds the node (jvmRoute) to the session id, e.g. 27ACAB87D47C1764A536D1ABBD7BC27E.app26, and it changes
+# when a session fails over to another node
+jvm_route_pattern = re.compile(r'\.[^.]*$')
+
+# one call in a session.  start/end are epoch milliseconds, gap is the time since the previous call in the session
+# ended (0 for the first call, or when they overlap).  request is None when the request entry wasn't found
+Call = namedtuple('Call', 'start end duration gap offset request response')
+
+# numbers for one session, as shown in the slowest sessions list
+SessionSummary = namedtuple('SessionSummary', 'session_id host tenant calls total longest span gap errors first_timestamp')
+
+
+# Session id as it should be grouped: no node suffix or jsessionid= prefix, upper case.  '' for entries without one
+def normalize_session_id(sessionid : Optional[str]) -> str:
+    if not sessionid:
+        return ''
+    sessionid = sessionid.strip()
+    if sessionid.lower().startswith('jsessionid='):
+        sessionid = sessionid[len('jsessionid='):]
+    sessionid = jvm_route_pattern.sub('', sessionid)
+    if not sessionid or sessionid.strip('-') == '':
+        return ''
+    return sessionid.upper()
+
+# '2023-01-21 03:00:00,030' strings to epoch milliseconds, all at once
+def to_milliseconds(timestamps : List[str]) -> np.ndarray:
+    if not timestamps:
+        return np.array([], dtype=np.int64)
+    return np.array([timestamp.replace(',', '.') for timestamp in timestamps], dtype='datetime64[ms]').astype(np.int64)
+
+
+class SessionIndex:
+    @metrics.timed('session_index')
+    def __init__(self, log_entries : List[LogEntry]):
+        self.log_entries = log_entries
+        self.names : List[str] = []
+        codes_by_name : Dict[str, int] = {}
+
+        entry_sessions = []     # every request and response with a session, for entries()
+        entry_positions = []
+        sessions = []
+        requests = []
+        responses = []
+        durations = []
+        pending : Dict[tuple, int] = {}     # (host, thread) -> position of the request waiting for its response
+        for position, entry in enumerate(log_entries):
+            if entry.type != LogType.REQUEST and entry.type != LogType.RESPONSE:
+                continue
+            name = normalize_session_id(entry.sessionid)
+            code = -1
+            if name:
+                code = codes_by_name.get(name)
+                if code is None:
+                    code = codes_by_name[name] = len(self.names)
+                    self.names.append(name)
+                entry_sessions.append(code)
+                entry_positions.append(position)
+            if entry.type == LogType.REQUEST:
+                pending[(entry.host, entry.thread)] = position
+            else:
+                request = pending.pop((entry.host, entry.thread), -1)
+                if request >= 0 and log_entries[request].path != entry.path:
+                    request = -1
+                if code < 0:
+                    continue
+                sessions.append(code)
+                requests.append(request)
+                responses.append(position)
+                durations.append(entry.duration or 0)
+        self.codes_by_name = codes_by_name
+        # positions are already in order, so a stable sort by session keeps each session's entries in log order
+        entry_sessions = np.array(entry_sessions, dtype=np.int32)
+        entry_order = np.argsort(entry_sessions, kind='stable')
+        self.entry_positions = np.array(entry_positions, dtype=np.int64)[entry_order]
+        self.entry_offsets = np.concatenate(([0], np.cumsum(np.bincount(entry_sessions, minlength=len(self.names))))).astype(np.int64)
+
+        session = np.array(sessions, dtype=np.int32)
+        request = np.array(requests, dtype=np.int64)
+        response = np.array(responses, dtype=np.int64)
+        duration = np.array(durations, dtype=np.int64)
+        end = to_milliseconds([log_entries[position].timestamp for position in responses])
+        # start at the request if we have it, otherwise work back from the response
+        start = end - duration
+        paired = request >= 0
+        start[paired] = to_milliseconds([log_entries[position].timestamp for position in request[paired]])
+        error = np.array([log_entries[position].response_code.startswith('5') for position in responses], dtype=bool)
+
+        order = np.lexsort((start, session))
+        self.session = session[order]
+        self.request = request[order]
+        self.response = response[order]
+        self.duration = duration[order]
+        self.start = start[order]
+        self.end = end[order]
+        self.error = error[order]
+        self.summarize()
+
+    def __len__(self):
+        return len(self.names)
+
+    # per session numbers for all sessions at once
+    def summarize(self):
+        self.counts = np.bincount(self.session, minlength=len(self.names))
+        self.offsets = np.concatenate(([0], np.cumsum(self.counts)[:-1])).astype(np.int64)
+        # gap before each call: since the end of the previous call in the same session
+        self.gap = np.zeros(len(self.start), dtype=np.int64)
+        if len(self.start):
+            self.gap[1:] = np.maximum(self.start[1:] - self.end[:-1], 0)
+            self.gap[self.offsets] = 0
+        # sessions with only requests (no response yet) have no calls, and stay at zero
+        self.present = self.counts > 0
+        starts = self.offsets[self.present]
+        self.totals, self.longest, self.spans, self.gaps, self.errors = (np.zeros(len(self.names), dtype=np.int64) for _ in range(5))
+        if len(starts) == 0:
+            return
+        self.totals[self.present] = np.add.reduceat(self.duration, starts)
+        self.longest[self.present] = np.maximum.reduceat(self.duration, starts)
+        self.spans[self.present] = np.maximum.reduceat(self.end, starts) - self.start[starts]
+        self.gaps[self.present] = np.maximum.reduceat(self.gap, starts)
+        self.errors[self.present] = np.add.reduceat(self.error.astype(np.int64), starts)
+
+    def column(self, sort : str) -> np.ndarray:
+        return {'total': self.totals, 'longest': self.longest, 'span': self.spans, 'gap': self.gaps,
+                'calls': self.counts, 'errors': self.errors}[sort]
+
+    # Sessions with the highest value of sort, highest first.  tenant and host narrow it down
+    def slowest(self, sort : str = 'total', limit : int = DEFAULT_LIMIT, tenant : Optional[str] = None, host : Optional[str] = None) -> List[SessionSummary]:
+        if sort not in SORT_COLUMNS:
+            sort = 'total'
+        values = self.column(sort)
+        candidates = np.flatnonzero(self.present)
+        if tenant or host:
+            first = self.response[self.offsets[candidates]]
+            keep = np.array([(not tenant or self.log_entries[position].tenant == tenant) and (not host or self.log_entries[position].host == host)
+                             for position in first], dtype=bool)
+            candidates = candidates[keep]
+        if len(candidates) > limit:
+            candidates = candidates[np.argpartition(-values[candidates], limit - 1)[:limit]]
+        candidates = candidates[np.argsort(-values[candidates], kind='stable')]
+        return [self.summary(code) for code in candidates]
+
+    def summary(self, code : int) -> SessionSummary:
+        first = self.log_entries[self.response[self.offsets[code]]]
+        return SessionSummary(self.names[code], first.host, first.tenant, int(self.counts[code]), int(self.totals[code]),
+                              int(self.longest[code]), int(self.spans[code]), int(self.gaps[code]), int(self.errors[code]),
+                              first.timestamp)
+
+    def find(self, session_id : str) -> Optional[int]:
+        return self.codes_by_name.get(normalize_session_id(session_id))
+
+    # the session's calls in start order, for the waterfall
+    def calls(self, session_id : str) -> List[Call]:
+        code = self.find(session_id)
+        if code is None or not self.present[code]:
+            return []
+        low, high = self.offsets[code], self.offsets[code] + self.counts[code]
+        session_start = self.start[low]
+        return [Call(int(self.start[i]), int(self.end[i]), int(self.duration[i]), int(self.gap[i]), int(self.start[i] - session_start),
+                     self.log_entries[self.request[i]] if self.request[i] >= 0 else None, self.log_entries[self.response[i]])
+                for i in range(low, high)]
+
+    # the session's request and response entries in log order, including requests that never got a response
+    def entries(self, session_id : str) -> List[LogEntry]:
+        code = self.find(session_id)
+        if code is None:
+            return []
+        positions = self.entry_positions[self.entry_offsets[code]:self.entry_offsets[code + 1]]
+        return [self.log_entries[position] for position in positions]
@@ -0,0 +1,208 @@
+import math
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from logindex import read_lines
+from structuredlog import iter_entries, LogEntry, LogType, STREAM_WINDOW
+from tool_entry import ToolEntry
+from instrument import metrics
+
+# Aggregators that take log entries one at a time and keep a fixed amount of state no matter how long the log is,
+# so a report can be worked out from iter_entries without ever holding the whole list.  Each one can be merged
+# with another of the same kind, e.g. to combine results from several files or servers.
+
+
+# Space-Saving style top-K counter.  Keeps at most capacity distinct keys; when it fills up the smaller half is
+# dropped, and keys seen after that start from the largest count dropped so far.  Counts can be over by at most
+# that amount (reported as the error), and any key seen more than error times is guaranteed to still be there.
+class TopCounter:
+    def __init__(self, capacity : int = 1000):
+        self.capacity = capacity
+        self.counts = Counter()
+        self.errors : Dict[str, int] = {}
+        self.floor = 0
+        self.total = 0
+
+    def add(self, key : str, count : int = 1):
+        self.total += count
+        if key not in self.counts and self.floor:
+            self.counts[key] = self.floor
+            self.errors[key] = self.floor
+        self.counts[key] += count
+        if len(self.counts) > self.capacity:
+            self.prune()
+
+    def prune(self):
+        ranked = self.counts.most_common()
+        keep = ranked[:self.capacity // 2]
+        self.floor = max(self.floor, ranked[len(keep)][1])
+        self.counts = Counter(dict(keep))
+        self.errors = {key: error for key, error in self.errors.items() if key in self.counts}
+
+    def merge(self, other : 'TopCounter'):
+        for key, count in other.counts.items():
+            self.counts[key] += count
+            if key in other.errors:
+                self.errors[key] = self.errors.get(key, 0) + other.errors[key]
+        self.total += other.total
+        self.floor = max(self.floor, other.floor)
+        if len(self.counts) > self.capacity:
+            self.prune()
+
+    # (key, count, error) for the most common keys
+    def most_common(self, limit : int = 10) -> List[Tuple[str, int, int]]:
+        return [(key, count, self.errors.get(key, 0)) for key, count in self.counts.most_common(limit)]
+
+
+# Percentile sketch with fixed relative error.  Values go into logarithmic buckets, bucket i holding values in
+# (gamma^(i-1), gamma^i], so any percentile comes back within relative_accuracy of the true value.  Durations from
+# 1ms to a day fit in under a thousand buckets.  Merging two sketches just adds the bucket counts.
+class DurationSketch:
+    def __init__(self, relative_accuracy : float = 0.01):
+        self.relative_accuracy = relative_accuracy
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self.log_gamma = math.log(self.gamma)
+        self.buckets = Counter()
+        self.zeros = 0
+        self.count = 0
+        self.sum = 0
+        self.max = 0
+
+    def add(self, value : float):
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+        if value <= 0:
+            self.zeros += 1
+        else:
+            self.buckets[math.ceil(math.log(value) / self.log_gamma)] += 1
+
+    def merge(self, other : 'DurationSketch'):
+        self.buckets.update(other.buckets)
+        self.zeros += other.zeros
+        self.count += other.count
+        self.sum += other.sum
+        self.max = max(self.max, other.max)
+
+    def percentile(self, level : float) -> float:
+        if self.count == 0:
+            return 0.0
+        rank = (level / 100.0) * (self.count - 1)
+        seen = self.zeros
+        if rank < seen:
+            return 0.0
+        for key in sorted(self.buckets):
+            seen += self.buckets[key]
+            if rank < seen:
+                # middle of the bucket, in relative terms
+                return min(2 * self.gamma ** key / (self.gamma + 1), self.max)
+        return float(self.max)
+
+    def mean(self) -> float:
+        return self.sum / self.count if self.count else 0.0
+
+
+# Counts tool starts and finishes and tracks how many were running at once, the same way
+# get_tools_and_mark_log_entries_with_concurrent_jobs does
+class ToolTracker:
+    def __init__(self):
+        self.started = 0
+        self.finished = 0
+        self.running = 0
+        self.max_running = 0
+        self.max_running_timestamp = ''
+        self.locations = Counter()
+        self.durations = DurationSketch()
+
+    def add(self, tool_entry : ToolEntry, timestamp : str):
+        if tool_entry.is_start():
+            self.started += 1
+            self.running += 1
+            self.locations[tool_entry.location] += 1
+            if self.running > self.max_running:
+                self.max_running = self.running
+                self.max_running_timestamp = timestamp
+        else:
+            self.finished += 1
+            self.running -= 1
+            if isinstance(tool_entry.duration, (int, float)):
+                self.durations.add(tool_entry.duration)
+
+    def merge(self, other : 'ToolTracker'):
+        self.started += other.started
+        self.finished += other.finished
+        self.running += other.running
+        if other.max_running > self.max_running:
+            self.max_running = other.max_running
+            self.max_running_timestamp = other.max_running_timestamp
+        self.locations.update(other.locations)
+        self.durations.merge(other.durations)
+
+
+# Everything the streaming report shows, built up an entry at a time
+class StreamReport:
+    def __init__(self, capacity : int = 1000):
+        self.entries = 0
+        self.exceptions = TopCounter(capacity)
+        self.durations = DurationSketch()
+        self.tools = ToolTracker()
+        self.first_timestamp = ''
+        self.last_timestamp = ''
+
+    def add(self, entry : LogEntry):
+        self.entries += 1
+        # files aren't always in order, so keep the earliest and latest rather than the first and last
+        if not self.first_timestamp or entry.timestamp < self.first_timestamp:
+            self.first_timestamp = entry.timestamp
+        self.last_timestamp = max(self.last_timestamp, entry.timestamp)
+        if entry.type == LogType.EXCEPTION:
+            self.exceptions.add(entry.get_exception())
+        elif entry.type == LogType.RESPONSE and entry.duration is not None:
+            self.durations.add(entry.duration)
+        elif ToolEntry.is_tool(entry):
+            self.tools.add(ToolEntry(entry), entry.timestamp)
+
+    def add_all(self, entries : Iterable[LogEntry], debug : bool = False):
+        for entry in entries:
+            if debug:
+                entry.dump()
+            self.add(entry)
+
+    def merge(self, other : 'StreamReport'):
+        self.entries += other.entries
+        self.exceptions.merge(other.exceptions)
+        self.durations.merge(other.durations)
+        self.tools.merge(other.tools)
+        if other.first_timestamp and (not self.first_timestamp or other.first_timestamp < self.first_timestamp):
+            self.first_timestamp = other.first_timestamp
+        self.last_timestamp = max(self.last_timestamp, other.last_timestamp)
+
+    def print(self, limit : int = 10):
+        print(f'entries: {self.entries:,}  from {self.first_timestamp} to {self.last_timestamp}')
+        print()
+        for exception, count, error in self.exceptions.most_common(limit):
+            estimate = f' (+/- {error})' if error else ''
+            print(f"Count: {count}{estimate} Exception: {exception}")
+        print()
+        durations = self.durations
+        print(f'responses: {durations.count:,}  mean: {durations.mean():.0f}ms  max: {durations.max}ms')
+        print('  '.join(f'P{level}: {durations.percentile(level):.0f}ms' for level in (50, 90, 95, 99)))
+        print()
+        tools = self.tools
+        print(f'tools started: {tools.started:,}  finished: {tools.finished:,}  most running: {tools.max_running} at {tools.max_running_timestamp}')
+        if tools.locations:
+            print('  '.join(f'{location}: {count:,}' for location, count in tools.locations.most_common()))
+        if tools.durations.count:
+            print(f'tool P95: {tools.durations.percentile(95):.0f}ms')
+
+
+# Reads the files one after another (in the order given, not sorted by timestamp) and prints the report
+@metrics.timed('stream')
+def stream_report(file_names : List[str], start : Optional[str] = None, end : Optional[str] = None, debug : bool = False,
+                  window : int = STREAM_WINDOW) -> StreamReport:
+    report = StreamReport()
+    for file_name in file_names:
+        report.add_all(iter_entries(read_lines(file_name, start, end), window), debug)
+    metrics.count('log_entries', report.entries)
+    report.print()
+    return report
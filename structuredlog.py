@@ -1,12 +1,15 @@
-from collections import Counter, defaultdict
+from collections import Counter, defaultdict, deque
 from enum import Enum
 from io import TextIOWrapper
 import re
-from typing import Dict, List
-import numpy as np
+import time
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
 import argparse
-import pandas as pd
-import numpy as np
+from logindex import read_lines
+from instrument import metrics, add_profile_arguments, start_profile, finish_profile
+
+# number of recent entries iter_entries holds on to so continuation lines can still find them
+STREAM_WINDOW = 10000
 
 log_entry_pattern = re.compile( r'^(?P<timestamp>\d\d\d\d-\d\d-\d\d \d\d:\d\d:\d\d,\d\d\d)\s+(?P<level>[A-Z]+)\s+\[(?P<source>[^]]+)\]\s+\((?P<thread>[^)]+)\) (?P<message>.*)$')
 #                                                                                                                                                                  ^- rest of line is message
@@ -33,6 +36,14 @@ sessionid_pattern = re.compile( 'jsessionid=.*')
 oid_pattern = re.compile( '/[a-zA-Z]{3}[a-zA-Z$0-9]{11}/')
 oid_other_pattern = re.compile( r'/(banner|assignments|submissions)/.*')
 
+# Scrubs session ids, OIDs and query string from a request path so requests for the same page group together
+def deidentify_path(path : str) -> str:
+    request =  path.split('?', 1)[0]
+    request = re.sub( sessionid_pattern, 'jsessionid', request)
+    request = re.sub( oid_pattern, '/*OID*/', request)
+    request = re.sub( oid_other_pattern, r'/\1/*OID*', request)
+    return request
+
 
 class LogType(Enum):
     PLAIN = 1
@@ -41,6 +52,8 @@ class LogType(Enum):
     EXCEPTION = 4
 
 class LogEntry:
+    # server the entry came from, see hosts.py.  Set by the loader after parsing
+    host = ''
 
     def __init__(self, match : re.Match[str], line_number : int):
         self.line_number = line_number
@@ -112,11 +125,7 @@ class LogEntry:
     def get_deidentified_path(self):
         if not (self.is_response() or self.is_request()):
             return None
-        request =  self.path.split('?', 1)[0]
-        request = re.sub( sessionid_pattern, 'jsessionid', request)
-        request = re.sub( oid_pattern, '/*OID*/', request)
-        request = re.sub( oid_other_pattern, r'/\1/*OID*', request)
-        return request
+        return deidentify_path(self.path)
 
     def dump(self):
         print('>*******************************')
@@ -141,7 +150,9 @@ class LogEntry:
 
 
 def process_line( log_entries : List[LogEntry], thread_entries, line_number : int, line : str):
-    match = log_entry_pattern.match(line)
+    process_match(log_entries, thread_entries, line_number, line, log_entry_pattern.match(line))
+
+def process_match( log_entries : List[LogEntry], thread_entries, line_number : int, line : str, match : re.Match[str]):
     if match:
         log = LogEntry(match, line_number)
         if log.message.startswith('\t') and log.thread in thread_entries:
@@ -154,30 +165,99 @@ def process_line( log_entries : List[LogEntry], thread_entries, line_number : in
             log_entries[-1].add_line(line)
 
 
-def process_file(open_file: TextIOWrapper) -> List[LogEntry]:
-    log_entry = None
-    log_entries : List[LogEntry] = []
+# lines are (line number, line) pairs, see logindex.read_lines.  Pass in log_entries and thread_entries from the
+# last call to carry on where it left off
+def process_lines(lines: Iterable[Tuple[int, str]], log_entries : List[LogEntry] = None, thread_entries : dict = None) -> List[LogEntry]:
+    log_entries = [] if log_entries is None else log_entries
+    thread_entries = {} if thread_entries is None else thread_entries
+    if metrics.detailed:
+        return process_lines_timed(lines, log_entries, thread_entries)
+
+    with metrics.stage('parse'):
+        line_count = 0
+        for line_number, line in lines:
+            line = line.rstrip()
+            
+            process_line(log_entries, thread_entries, line_number, line)
+            line_count += 1
+
+    metrics.count('lines', line_count)
+    return log_entries
+
+# process_lines, keeping track of time spent reading, matching and building entries.  Used when profiling
+def process_lines_timed(lines: Iterable[Tuple[int, str]], log_entries : List[LogEntry], thread_entries : dict) -> List[LogEntry]:
+    read_time = match_time = build_time = 0.0
+    line_count = 0
+    clock = time.perf_counter
+    before_read = clock()
+    for line_number, line in lines:
+        before_match = clock()
+        line = line.rstrip()
+        match = log_entry_pattern.match(line)
+        before_build = clock()
+        process_match(log_entries, thread_entries, line_number, line, match)
+        after_build = clock()
+        read_time += before_match - before_read
+        match_time += before_build - before_match
+        build_time += after_build - before_build
+        before_read = after_build
+        line_count += 1
+
+    metrics.add_time('read', read_time, line_count)
+    metrics.add_time('regex_match', match_time, line_count)
+    metrics.add_time('entry_build', build_time, line_count)
+    metrics.count('lines', line_count)
+    return log_entries
+
+# Like process_lines, but yields entries instead of keeping them all.  The last 'window' entries are held back so
+# continuation lines (stack traces, same thread entries starting with a tab) can still be added to them; older
+# entries are yielded in file order and forgotten.  A continuation for an entry that's already gone becomes an
+# entry of its own.
+def iter_entries(lines: Iterable[Tuple[int, str]], window : int = STREAM_WINDOW) -> Iterator[LogEntry]:
+    pending = deque()
     thread_entries = {}
+    line_count = 0
 
-    for line_number, line in enumerate(open_file):
+    for line_number, line in lines:
         line = line.rstrip()
-        
-        process_line(log_entries, thread_entries, line_number + 1, line)
+        line_count += 1
+        match = log_entry_pattern.match(line)
+        if match:
+            log = LogEntry(match, line_number)
+            if log.message.startswith('\t') and log.thread in thread_entries:
+                thread_entries[log.thread].add_line(log.message)
+                continue
+            pending.append(log)
+            thread_entries[log.thread] = log
+            if len(pending) > window:
+                done = pending.popleft()
+                if thread_entries.get(done.thread) is done:
+                    del thread_entries[done.thread]
+                yield done
+        elif pending:
+            pending[-1].add_line(line)
 
-    return log_entries
+    metrics.count('lines', line_count)
+    yield from pending
 
-def process( file_names : List[str]) -> List[LogEntry]:
+def process_file(open_file: TextIOWrapper) -> List[LogEntry]:
+    return process_lines(enumerate(open_file, 1))
+
+# start and end limit entries to a time window, e.g. '2023-01-21 03:00'.  See logindex
+def process( file_names : List[str], start : Optional[str] = None, end : Optional[str] = None) -> List[LogEntry]:
     if not file_names:
         return []
     
     list = []
     for file_name in file_names:
-        with open(file_name) as open_file:
-            list.extend(process_file(open_file))
-            print('list len ', len(list))
-    list.sort(key=lambda x: x.timestamp)
+        list.extend(process_lines(read_lines(file_name, start, end)))
+        print('list len ', len(list))
+    with metrics.stage('sort'):
+        list.sort(key=lambda x: x.timestamp)
+    metrics.count('log_entries', len(list))
     return list
 
+@metrics.timed('exception_grouping')
 def show_exceptions(log_entries : List[LogEntry]):
     counter = Counter()
     for entry in log_entries:
@@ -191,8 +271,12 @@ def calculate_p95(log_entries : List[LogEntry]) -> int:
     times_raw = [log_entry.duration for log_entry in log_entries if log_entry.type == LogType.RESPONSE]
     if len(times_raw) == 0:
         return 0
-    times = np.array(times_raw)
-    return int(np.percentile(times, 95))
+    # linear interpolation between the closest ranks, same as np.percentile, without needing numpy here
+    times = sorted(times_raw)
+    position = (len(times) - 1) * 0.95
+    low = int(position)
+    high = min(low + 1, len(times) - 1)
+    return int(times[low] + (times[high] - times[low]) * (position - low))
     # return 99
 
 
@@ -205,9 +289,21 @@ def main():
     # parser.add_argument('--output', action='store', default='', required=False, help='Output file name for csv (defaults to stdout)')
     parser.add_argument('--debug', action='store_true', required=False, help='Dumps debug output')
     parser.add_argument('--exception', action='store_true', required=False, help='Shows exceptions in the log')
+    parser.add_argument('--stream', action='store_true', required=False, help='Reads entries one at a time in constant memory, without sorting.  Shows top exceptions, response time percentiles and tool counts')
+    parser.add_argument('--from', dest='start', action='store', required=False, help='Only read entries at or after this time, e.g. "2023-01-21 03:00"')
+    parser.add_argument('--to', dest='end', action='store', required=False, help='Only read entries up to this time, inclusive, e.g. "2023-01-21 03:05"')
+    add_profile_arguments(parser)
     args = parser.parse_args()
+    profiler = start_profile(args)
 
-    log_entries = process([args.filename])
+    if args.stream:
+        # streaming imports this module, so go through it to get the same LogEntry/LogType classes
+        from streaming import stream_report
+        stream_report([args.filename], args.start, args.end, args.debug)
+        finish_profile(args, profiler)
+        return
+
+    log_entries = process([args.filename], args.start, args.end)
     if args.debug:
         for entry in log_entries:
             entry.dump()
@@ -215,6 +311,8 @@ def main():
     if args.exception:
         show_exceptions(log_entries)
 
+    finish_profile(args, profiler)
+
     # if args.list:
         # list_counters(perfmon_entries)
     # if args.csv:
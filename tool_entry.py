@@ -1,6 +1,8 @@
+from collections import defaultdict
 from enum import Enum
 from typing import List
 from structuredlog import process, LogEntry, LogType
+from instrument import metrics
 import json
 
 class ToolEntryType(Enum):
@@ -36,16 +38,19 @@ class ToolEntry:
         return entry.message.startswith( 'TOOL START:') or entry.message.startswith('TOOL FINISH:')
     
 
+@metrics.timed('tool_pairing')
 def get_tools(log_entries : List[LogEntry]) -> List[ToolEntry]:
     return [ToolEntry(entry) for entry in log_entries if ToolEntry.is_tool(entry)]
 
+# concurrent jobs are counted per host, since each server runs its own tools
+@metrics.timed('tool_pairing')
 def get_tools_and_mark_log_entries_with_concurrent_jobs(log_entries) -> List[ToolEntry]:
     tool_entries : List[ToolEntry] = []
-    running_count = 0   # number of tools "running" right now
+    running_counts = defaultdict(int)   # number of tools "running" right now, by host
     for entry in log_entries:
         if ToolEntry.is_tool(entry):
             tool_entry = ToolEntry(entry)
             tool_entries.append(tool_entry)
-            running_count += 1 if tool_entry.is_start() else -1
-        entry.concurrent_jobs = running_count
+            running_counts[entry.host] += 1 if tool_entry.is_start() else -1
+        entry.concurrent_jobs = running_counts[entry.host]
     return tool_entries
\ No newline at end of file